@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Measures the request latency of the handler with the MQTT publication done
+after the InfluxDB write (--concurrent-dispatch no) and concurrently with it,
+with one and many clients sending at the same time, using the stand-in
+backends of the replay tool with simulated latencies.
+
+    PYTHONPATH=src python benchmarks/bench_dispatch.py --workers 1,16
+"""
+
+import sys
+import argparse
+
+import sfds_replay
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--influxdb-latency', type=float, default=0.010)
+    parser.add_argument('--mqtt-latency', type=float, default=0.008)
+    parser.add_argument('--workers', type=str, default='1,16',
+                        help='comma separated numbers of concurrent clients')
+    args = parser.parse_args()
+
+    sfds_replay.install_stand_ins(args.influxdb_latency, args.mqtt_latency)
+
+    sys.stdout.write(
+        'stand-in latency: InfluxDB {:.1f} ms, MQTT {:.1f} ms\n'.format(
+            1000 * args.influxdb_latency, 1000 * args.mqtt_latency))
+
+    for _workers in [int(_w) for _w in args.workers.split(',')]:
+        for _concurrent in (False, True):
+            _sender = sfds_replay.InProcessSender(
+                p_options={'concurrent_dispatch': _concurrent})
+            _results, _elapsed = sfds_replay.replay(
+                sfds_replay.synthetic_records(args.requests), _sender,
+                p_speed=0, p_workers=_workers)
+
+            sys.stdout.write('\n--concurrent-dispatch {}, {:d} clients\n'
+                             .format('yes' if _concurrent else 'no',
+                                     _workers))
+            sfds_replay.report(_results, _elapsed)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:ts=4:expandtab
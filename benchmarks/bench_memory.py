@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Measures the resident memory of the handler under a steady request rate and
+reports it per 1k requests/s, optionally with a memory budget and with the
+tracemalloc top allocation sites.
+
+    PYTHONPATH=src python benchmarks/bench_memory.py --rate 1000
+"""
+
+import sys
+import argparse
+import threading
+
+import sfds_replay
+import feinstaub_publisher
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rate', type=float, default=1000.0)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--stations', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--memory-budget', type=int, default=0)
+    parser.add_argument('--trace', action='store_true')
+    args = parser.parse_args()
+
+    sfds_replay.install_stand_ins()
+    _sender = sfds_replay.InProcessSender(p_options={
+        'memory_budget': args.memory_budget,
+        'memory_trace': args.trace})
+
+    v_baseline = feinstaub_publisher.resident_memory()
+    v_samples = []
+    v_stop = threading.Event()
+
+    def _sample():
+        while not v_stop.wait(0.05):
+            v_samples.append(feinstaub_publisher.resident_memory())
+
+    _sampler = threading.Thread(target=_sample, daemon=True)
+    _sampler.start()
+
+    _results, _elapsed = sfds_replay.replay(
+        sfds_replay.synthetic_records(
+            int(args.rate * args.duration), args.stations, 1.0 / args.rate),
+        _sender, p_workers=args.workers)
+
+    v_stop.set()
+    _sampler.join()
+
+    sfds_replay.report(_results, _elapsed)
+
+    _peak = max(v_samples or [v_baseline])
+    _throughput = len(_results) / _elapsed
+    _mib = 1024.0 * 1024.0
+
+    sys.stdout.write('rss        : baseline {:.1f} MiB, peak {:.1f} MiB\n'
+                     .format(v_baseline / _mib, _peak / _mib))
+    sys.stdout.write('rss        : {:.1f} MiB per 1k req/s, growth {:.2f} MiB '
+                     'per 1k req/s\n'.format(
+                         _peak / _mib / (_throughput / 1000.0),
+                         (_peak - v_baseline) / _mib / (_throughput / 1000.0)))
+
+    if args.trace:
+        for _site in feinstaub_publisher.memory_report(5)['top']:
+            sys.stdout.write('{:>10d} B {:>6d} {}\n'.format(
+                _site['size'], _site['count'], _site['site']))
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:ts=4:expandtab
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Compares the MQTT traffic generated by a burst of requests, as after a
+gateway Wi-Fi reconnect, when each request is published on its own and when
+the messages are coalesced on a tick (--mqtt-tick), with and without
+collapsing the messages of the same topic (--mqtt-collapse).
+
+    PYTHONPATH=src python benchmarks/bench_mqtt.py
+"""
+
+import sys
+import time
+import argparse
+
+import sfds_replay
+import feinstaub_publisher
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=600)
+    parser.add_argument('--stations', type=int, default=50)
+    parser.add_argument('--interval', type=float, default=0.001)
+    parser.add_argument('--tick', type=float, default=0.25)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--mqtt-latency', type=float, default=0.002)
+    args = parser.parse_args()
+
+    sys.stdout.write(
+        '{:d} requests from {:d} stations, {:.1f} ms apart\n'.format(
+            args.requests, args.stations, 1000 * args.interval))
+
+    v_runs = ((0, False), (args.tick, False), (args.tick, True))
+
+    for _tick, _collapse in v_runs:
+        _publisher = sfds_replay.install_stand_ins(0.0, args.mqtt_latency)
+        _sender = sfds_replay.InProcessSender(p_options={
+            'mqtt_tick': _tick, 'mqtt_collapse': _collapse})
+
+        _cpu = time.process_time()
+        _results, _elapsed = sfds_replay.replay(
+            sfds_replay.synthetic_records(
+                args.requests, args.stations, args.interval),
+            _sender, p_workers=args.workers)
+
+        _output = feinstaub_publisher.app.config['MQTT_OUTPUT']
+        if _output is not None:
+            _output.close()
+        _cpu = time.process_time() - _cpu
+
+        sys.stdout.write('\n--mqtt-tick {} --mqtt-collapse {}\n'.format(
+            _tick, _collapse))
+        sfds_replay.report(_results, _elapsed)
+        sys.stdout.write(
+            'broker     : {:d} messages, {:d} connections\n'.format(
+                _publisher.messages, _publisher.connections))
+        sys.stdout.write('cpu        : {:.3f} s\n'.format(_cpu))
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:ts=4:expandtab
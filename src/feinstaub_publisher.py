@@ -16,16 +16,29 @@
 #  limitations under the License.
 #
 
+import os
+import re
 import sys
+import gzip
 import json
+import time
 import flask
+import bisect
+import hashlib
+import atexit
+import base64
 import signal
 import socket
 import logging
 import influxdb
 import argparse
 import datetime
+import threading
+import tracemalloc
+import collections
 import configparser
+from concurrent.futures import Future
+import paho.mqtt.client as mqtt
 import paho.mqtt.publish as publish
 from werkzeug.utils import cached_property
 from influxdb.exceptions import InfluxDBClientError
@@ -36,8 +49,29 @@ MQTT_LOCAL_PORT = 1883            # MQTT Broker port
 INFLUXDB_DB = "luftdaten"         # INFLUXDB database
 INFLUXDB_HOST = "localhost"     # INFLUXDB address
 INFLUXDB_PORT = 8086            # INFLUXDB port
+INFLUXDB_TARGETS = ""           # INFLUXDB host:port shards (default: host)
+INFLUXDB_REPLICAS = 1           # INFLUXDB targets written for each station
+INFLUXDB_POOL_SIZE = 4          # INFLUXDB keep-alive connections per target
+CONCURRENT_DISPATCH = True      # MQTT and InfluxDB replicas in parallel
+MQTT_TICK = 0.0                 # Seconds between MQTT bursts (0: disabled)
+MQTT_INFLIGHT = 20              # QoS 1 messages awaiting PUBACK at once
+MQTT_MAX_QUEUED = 1000          # QoS 1 messages queued behind the window
+MQTT_MESSAGE_SIZE = 1024        # Estimated memory held by a queued message
 GPS_LOCATION = "0.0,0.0"        # DEFAULT location
 
+MEMORY_BUDGET = 0               # Memory budget in MiB (0: disabled)
+MEMORY_SHED_RATIO = 0.9         # Budget fraction above which requests are shed
+MEMORY_RESUME_RATIO = 0.7       # Budget fraction below which shedding stops
+MEMORY_TOP = 10                 # Allocation sites listed in memory reports
+
+FIELD_INCLUDE = ""              # Fields kept (default: all)
+FIELD_EXCLUDE = ""              # Fields dropped (default: none)
+
+CAPTURE_FILE = ""               # Traffic capture file (disabled if empty)
+CAPTURE_MAX_BYTES = 4194304     # Capture size (uncompressed) before rotation
+CAPTURE_BACKUP_COUNT = 3        # Number of rotated capture files to keep
+CAPTURE_BUFFER_SIZE = 16384     # Bytes buffered before writing to the file
+
 
 APPLICATION_NAME = 'FEINSTAUB_publisher'
 
@@ -48,21 +82,36 @@ class INFLUXDBRequest(flask.Request):
     # accept up to 1kB of transmitted data.
     max_content_length = 1024
 
+    FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
     @cached_property
     def get_payload(self):
-        _form_content_type = 'application/x-www-form-urlencoded'
-        if self.headers.get('content-type') == _form_content_type:
-            l_points = []
-            v_payload = self.get_data()
-            v_points = v_payload.splitlines()
-            for _point in v_points:
-                l_points.append(
-                    dict(
-                        zip(
-                            ['tag_set', 'field_set', 'timestamp'],
-                            _point.decode().split())))
+        if self.headers.get('content-type') == self.FORM_CONTENT_TYPE:
+            return parse_points(self.get_data())
+
+
+# The parts of an InfluxDB line protocol point
+POINT_KEYS = ['tag_set', 'field_set', 'timestamp']
+
 
-            return l_points
+def parse_points(p_data):
+    """
+    Splits the InfluxDB line protocol points in tag set, field set and
+    timestamp.
+    """
+    if isinstance(p_data, bytes):
+        p_data = p_data.decode()
+
+    l_points = []
+    v_points = p_data.splitlines()
+    for _point in v_points:
+        l_points.append(
+            dict(
+                zip(
+                    POINT_KEYS,
+                    _point.split())))
+
+    return l_points
 
 
 PARAMETERS_MAP = {
@@ -89,113 +138,755 @@ PARAMETERS_MAP = {
 MESSAGE_PARAMETERS = PARAMETERS_MAP.keys()
 
 
-@app.route("/write", methods=['POST'])
-def publish_data():
-    v_logger = app.config['LOGGER']
-
-    v_mqtt_local_host = app.config['MQTT_LOCAL_HOST']
-    v_mqtt_local_port = app.config['MQTT_LOCAL_PORT']
-    v_topic = app.config['MQTT_TOPIC']
-    v_influxdb_host = app.config['INFLUXDB_HOST']
-    v_influxdb_port = app.config['INFLUXDB_PORT']
-
-    v_latitude = app.config['LATITUDE']
-    v_longitude = app.config['LONGITUDE']
-
-    _data = flask.request.get_data()
-    _args = flask.request.args.to_dict()
-    _auth = flask.request.authorization
-    _db = _args.get('db')
-
-    # The required 'db' must match the configured db
-    if _db != app.config['INFLUXDB_DB']:
-        v_logger.error('Query not allowed: invalid db.')
-        _response = flask.make_response('Query not allowed: invalid db.', 400)
-        return _response
-
-    if _auth is None:
-        _db_username = None
-        _db_password = None
-    else:
-        _db_username = _auth['username']
-        _db_password = _auth['password']
-
-    # Ok, a dirty hack
-    # In presence of a GPS module, SDFS sends GPS date and time as unquoted
-    # strings and they cannot be saved to Influxdb.  Here these values are
-    # removed from the message and replaced by a ISO format time string
-    _m, _f = _data.decode().split(' ')
-    _gps_dts = {
-        _i.split('=')[0]: _i.split('=')[1]
-        for _i in _f.split(',')
-        if _i.startswith('GPS_')
+class CaptureWriter(object):
+    """
+    Records the requests received on the /write route to a gzip compressed
+    file, one JSON object per line, for later replay. Records are buffered in
+    memory and written in chunks of at least buffer_size bytes; the file is
+    rotated when the uncompressed data written to it exceeds max_bytes,
+    keeping up to backup_count older files (capture.gz.1, capture.gz.2...).
+    """
+
+    # Only the headers relevant to the handler are recorded. Authorization is
+    # deliberately left out so that captures can be shared safely.
+    HEADERS = ('Content-Type', 'User-Agent', 'X-Sensor', 'X-PIN')
+
+    def __init__(self, filename, max_bytes=CAPTURE_MAX_BYTES,
+                 backup_count=CAPTURE_BACKUP_COUNT,
+                 buffer_size=CAPTURE_BUFFER_SIZE):
+        self._filename = filename
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._buffer_size = buffer_size
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffered = 0
+        self._written = self._existing_size(filename)
+        self._stream = None
+
+    @staticmethod
+    def _existing_size(p_filename):
+        """
+        Returns the uncompressed size of an existing capture file, so that the
+        rotation limit holds across restarts.
+        """
+        if not os.path.exists(p_filename):
+            return 0
+
+        _size = 0
+        try:
+            with gzip.open(p_filename, 'rb') as _f:
+                for _chunk in iter(lambda: _f.read(65536), b''):
+                    _size += len(_chunk)
+        except (OSError, EOFError):
+            # Truncated by an unclean shutdown: the compressed size is a
+            # lower bound
+            _size = max(_size, os.path.getsize(p_filename))
+        return _size
+
+    def record(self, p_request, p_arrival):
+        _headers = {
+            _h: p_request.headers[_h]
+            for _h in self.HEADERS if _h in p_request.headers}
+
+        _record = {
+            'time': p_arrival,
+            'args': p_request.args.to_dict(),
+            'headers': _headers,
+            # latin-1 maps every byte to a character, the body is restored
+            # unchanged by encoding it back.
+            'body': p_request.get_data().decode('latin-1')
+        }
+        _line = json.dumps(_record, separators=(',', ':')) + '\n'
+
+        with self._lock:
+            self._buffer.append(_line)
+            self._buffered += len(_line)
+            if self._buffered >= self._buffer_size:
+                self._flush()
+
+    def held_bytes(self):
+        return self._buffered
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+
+    def _flush(self):
+        if not self._buffer:
+            return
+
+        if self._stream is None:
+            self._stream = gzip.open(self._filename, 'ab')
+
+        _chunk = ''.join(self._buffer).encode('latin-1')
+        self._stream.write(_chunk)
+        self._written += len(_chunk)
+
+        self._buffer = []
+        self._buffered = 0
+
+        if self._max_bytes > 0 and self._written >= self._max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._stream.close()
+        self._stream = None
+        self._written = 0
+
+        if self._backup_count <= 0:
+            os.remove(self._filename)
+            return
+
+        for _i in range(self._backup_count - 1, 0, -1):
+            _src = '{}.{:d}'.format(self._filename, _i)
+            _dst = '{}.{:d}'.format(self._filename, _i + 1)
+            if os.path.exists(_src):
+                os.replace(_src, _dst)
+        os.replace(self._filename, '{}.1'.format(self._filename))
+
+
+class MQTTOutputStage(object):
+    """
+    Collects the MQTT messages of all the in-flight requests and publishes
+    them together every `tick` seconds on a persistent connection, with QoS 1
+    and at most `inflight` messages awaiting acknowledgement.  Up to
+    `max_queued` messages wait for the tick and as many are queued behind the
+    in-flight window, the others are dropped.  When `collapse` is set, only
+    the latest message for each topic is published in a tick.
+    """
+
+    # Seconds allowed at shutdown for the queued messages to be acknowledged
+    CLOSE_TIMEOUT = 5.0
+
+    def __init__(self, hostname, port, tick, collapse=False,
+                 inflight=MQTT_INFLIGHT, max_queued=MQTT_MAX_QUEUED,
+                 logger=None):
+        self._tick = tick
+        self._collapse = collapse
+        self._logger = logger or logging.getLogger(APPLICATION_NAME)
+
+        self._lock = threading.Lock()
+        self._pending = collections.OrderedDict() if collapse else []
+        self._unacked = []
+        self._stop = threading.Event()
+
+        self.published = 0
+        self.collapsed = 0
+        self.dropped = 0
+
+        try:
+            self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        except AttributeError:
+            # paho-mqtt < 2.0
+            self._client = mqtt.Client()
+        self._client.max_inflight_messages_set(inflight)
+        self._client.max_queued_messages_set(max_queued)
+        self._max_pending = max_queued
+        self._client.connect_async(hostname, port)
+        self._client.loop_start()
+
+        self._thread = threading.Thread(
+            target=self._run, name='mqtt-output', daemon=True)
+        self._thread.start()
+
+    def put(self, p_messages):
+        # Messages beyond max_queued waiting for the tick are dropped
+        with self._lock:
+            if self._collapse:
+                for _message in p_messages:
+                    _topic = _message['topic']
+                    if _topic in self._pending:
+                        # Moves the topic to the end, keeping the arrival
+                        # order of the latest messages
+                        del self._pending[_topic]
+                        self.collapsed += 1
+                    elif len(self._pending) >= self._max_pending:
+                        self.dropped += 1
+                        continue
+                    self._pending[_topic] = _message
+            else:
+                _space = max(self._max_pending - len(self._pending), 0)
+                self._pending.extend(p_messages[:_space])
+                self.dropped += max(len(p_messages) - _space, 0)
+
+    def held_bytes(self):
+        """
+        Estimated memory held by the messages waiting for the tick or for
+        their acknowledgement.
+        """
+        return (len(self._pending) + len(self._unacked)) * MQTT_MESSAGE_SIZE
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            if self._collapse:
+                _messages = list(self._pending.values())
+                self._pending = collections.OrderedDict()
+            else:
+                _messages = self._pending
+                self._pending = []
+
+        # Keeps the messages of the previous ticks not acknowledged yet, they
+        # are waited for at shutdown
+        self._unacked = [_i for _i in self._unacked if not _i.is_published()]
+
+        for _message in _messages:
+            _info = self._client.publish(
+                _message['topic'], _message['payload'], qos=1,
+                retain=_message.get('retain', False))
+            if _info.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+                self.dropped += 1
+            else:
+                self.published += 1
+                self._unacked.append(_info)
+
+        self._logger.debug(
+            'MQTT burst of {:d} messages ({:d} published, {:d} collapsed, '
+            '{:d} dropped so far)'.format(
+                len(_messages), self.published, self.collapsed, self.dropped))
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+        # The network loop must run until the queued messages are sent and
+        # acknowledged, then the connection is closed before stopping it
+        _deadline = time.monotonic() + self.CLOSE_TIMEOUT
+        for _info in self._unacked:
+            _timeout = _deadline - time.monotonic()
+            if _timeout <= 0:
+                break
+            try:
+                _info.wait_for_publish(_timeout)
+            except (ValueError, RuntimeError) as _ex:
+                # Not queued or not connected: nothing to wait for
+                self._logger.debug(_ex)
+
+        _lost = sum(1 for _i in self._unacked if not _i.is_published())
+        if _lost:
+            self._logger.warning(
+                '{:d} MQTT messages not acknowledged at shutdown.'.format(
+                    _lost))
+        self._unacked = []
+
+        self._client.disconnect()
+        self._client.loop_stop()
+
+    def _run(self):
+        while not self._stop.wait(self._tick):
+            try:
+                self.flush()
+            except Exception as _ex:
+                self._logger.error(_ex)
+
+
+class MemoryBudget(object):
+    """
+    Accounts the memory held by the handler for the requests being served and
+    for its own buffers and queues, which may use up to `budget` bytes on top
+    of the memory at startup.  Buffers and queues are sized from the budget.
+
+    The memory used is the larger of the accounted memory and the measured
+    growth of the memory over the baseline: the memory traced by tracemalloc
+    when tracing, the resident memory otherwise.  New requests are refused
+    once it is above `shed_ratio` of the budget, until it falls below
+    `resume_ratio` of it.  When only the measured growth is over the limit
+    and no request is being served, refusing requests cannot release it (the
+    memory is kept by the allocator or leaked): the baseline is moved up to
+    the current measure instead, so that the handler is not refusing every
+    request for good.
+    """
+
+    # Estimated memory held by a request being served: body, parsed points,
+    # sensor trees, MQTT messages and the werkzeug request objects
+    REQUEST_SIZE = 65536
+
+    # Seconds between two measures of the memory
+    SAMPLE_INTERVAL = 0.1
+
+    def __init__(self, budget, shed_ratio=MEMORY_SHED_RATIO,
+                 resume_ratio=MEMORY_RESUME_RATIO):
+        self.budget = budget
+        self.shed_ratio = shed_ratio
+        self.resume_ratio = resume_ratio
+        self.baseline = self._measure()
+        self.shed = 0
+        self.rebased = 0
+
+        self._lock = threading.Lock()
+        self._consumers = []
+        self._requests = 0
+        self._shedding = False
+        self._growth = 0
+        self._sampled = time.monotonic()
+
+    def items(self, p_fraction, p_item_size, p_maximum):
+        """
+        Returns how many items of p_item_size bytes fit in p_fraction of the
+        budget, between 1 and p_maximum.
+        """
+        _items = int(self.budget * p_fraction / p_item_size)
+        return max(1, min(_items, p_maximum))
+
+    def account(self, p_consumer):
+        """
+        Adds a callable returning the bytes held by a buffer or a queue.
+        """
+        self._consumers.append(p_consumer)
+
+    @staticmethod
+    def _measure():
+        if tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0]
+        return resident_memory()
+
+    def growth(self):
+        """
+        Returns the measured growth of the memory over the baseline, measured
+        again at most every SAMPLE_INTERVAL seconds.
+        """
+        _now = time.monotonic()
+        if _now - self._sampled >= self.SAMPLE_INTERVAL:
+            _measure = self._measure()
+            with self._lock:
+                self._sampled = _now
+                self._growth = max(0, _measure - self.baseline)
+        return self._growth
+
+    def accounted(self):
+        _accounted = sum(_consumer() for _consumer in self._consumers)
+        return _accounted + self._requests * self.REQUEST_SIZE
+
+    def used(self):
+        return max(self.accounted(), self.growth())
+
+    def enter(self):
+        """
+        Accounts a new request, returns False if it must be refused.
+        """
+        _buffers = sum(_consumer() for _consumer in self._consumers)
+        _growth = self.growth()
+        with self._lock:
+            _accounted = _buffers + self._requests * self.REQUEST_SIZE
+            if self._shedding:
+                _limit = self.budget * self.resume_ratio
+            else:
+                _limit = self.budget * self.shed_ratio
+
+            if (_growth > _limit and _accounted <= _limit and
+                    self._requests == 0):
+                self.baseline += _growth
+                self._growth = 0
+                self.rebased += 1
+                _growth = 0
+
+            self._shedding = max(_accounted, _growth) > _limit
+
+            if self._shedding:
+                self.shed += 1
+                return False
+
+            self._requests += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self._requests -= 1
+
+
+def resident_memory():
+    """
+    Returns the resident memory of the process in bytes, or the memory traced
+    by tracemalloc where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as _f:
+            return int(_f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return tracemalloc.get_traced_memory()[0]
+
+
+def memory_report(p_top=MEMORY_TOP):
+    """
+    Returns the resident memory, the budget, the accounted and measured
+    memory and, when tracemalloc is tracing, the p_top allocation sites by
+    size.
+    """
+    v_budget = app.config.get('MEMORY_BUDGET')
+
+    v_report = {
+        'resident': resident_memory(),
+        'baseline': v_budget.baseline if v_budget is not None else None,
+        'budget': v_budget.budget if v_budget is not None else None,
+        'used': v_budget.used() if v_budget is not None else None,
+        'accounted': v_budget.accounted() if v_budget is not None else None,
+        'growth': v_budget.growth() if v_budget is not None else None,
+        'shed': v_budget.shed if v_budget is not None else 0,
+        'rebased': v_budget.rebased if v_budget is not None else 0,
+        'traced': None,
+        'top': None
     }
 
-    if _gps_dts:
-        # Old firmware sends GPS data/time as two different keys
-        if 'GPS_data' in [*_gps_dts]:
-            _nmea_gps_format = '%m/%d/%Y-%H:%M:%S.%f'
-            _nmea_gps_string = '{:s}-{:s}'.format(
-                _gps_dts['GPS_date'], _gps_dts['GPS_time'])
-            _gps_dt = datetime.datetime.strptime(
-                _nmea_gps_string, _nmea_gps_format)
-            _influx_gps_time = 'GPS_time="{:%Y-%m-%dT%H:%M:%SZ}"'.format(_gps_dt)
-
-            _new_f = [_i for _i in _f.split(',')
-                      if not _i.startswith('GPS_date') and not
-                      _i.startswith('GPS_time')]
-
-            _new_f.insert(0, _influx_gps_time)
-            _new_f = ','.join(_new_f)
-            _data = ' '.join([_m, _new_f])
-
-    try:
-        _client = influxdb.InfluxDBClient(
-            host=v_influxdb_host,
-            port=v_influxdb_port,
-            username=_db_username,
-            password=_db_password,
-            database=_db
+    if tracemalloc.is_tracing():
+        _current, _peak = tracemalloc.get_traced_memory()
+        v_report['traced'] = {'current': _current, 'peak': _peak}
+
+        _snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')))
+        v_report['top'] = [
+            {'site': '{}:{:d}'.format(
+                _stat.traceback[0].filename, _stat.traceback[0].lineno),
+             'size': _stat.size,
+             'count': _stat.count}
+            for _stat in _snapshot.statistics('lineno')[:p_top]]
+
+    return v_report
+
+
+class InfluxDBTarget(object):
+    """
+    An InfluxDB instance written by the handler.  A single client, with its
+    pool of keep-alive connections, is shared by all the requests: the
+    credentials of each request are sent in its own Authorization header.
+    The databases already known to exist are checked only once.
+    """
+
+    def __init__(self, host, port, pool_size=INFLUXDB_POOL_SIZE):
+        self.host = host
+        self.port = port
+
+        # No default credentials: the requests without their own are sent
+        # anonymous, as the stations sent them
+        self._client = influxdb.InfluxDBClient(
+            host=host,
+            port=port,
+            username=None,
+            password=None,
+            pool_size=pool_size
         )
+        self._databases = set()
+
+    def __str__(self):
+        return '{}:{}'.format(self.host, self.port)
+
+    @staticmethod
+    def _headers(p_username, p_password, p_content_type):
+        _headers = {
+            'Content-Type': p_content_type,
+            'Accept': 'application/json'
+        }
+        if p_username is not None:
+            _credentials = '{}:{}'.format(p_username, p_password or '')
+            _headers['Authorization'] = 'Basic {}'.format(
+                base64.b64encode(_credentials.encode()).decode())
+        return _headers
+
+    def _query(self, p_username, p_password, p_method, p_query):
+        return self._client.request(
+            'query',
+            p_method,
+            params={'q': p_query},
+            expected_response_code=200,
+            headers=self._headers(
+                p_username, p_password, 'application/json'))
+
+    def check_database(self, p_username, p_password, p_db, p_logger):
+        """
+        Creates the database if it does not exist yet.  The check is done
+        again only after a write reports the database as missing.
+        """
+        if p_db in self._databases:
+            return
+
+        _result = self._query(p_username, p_password, 'GET', 'SHOW DATABASES')
+        _dbs = [_value[0]
+                for _series in _result.json()['results'][0].get('series', [])
+                for _value in _series.get('values', [])]
+        if p_db not in _dbs:
+            p_logger.info(
+                "InfluxDB database '{:s}' not found on {}. Creating a new one."
+                .format(p_db, self))
+            self._query(p_username, p_password, 'POST',
+                        'CREATE DATABASE "{}"'.format(p_db))
+
+        self._databases.add(p_db)
+
+    def write(self, p_username, p_password, p_params, p_data):
+        try:
+            return self._client.request(
+                'write',
+                'POST',
+                params=p_params,
+                data=p_data,
+                expected_response_code=204,
+                headers=self._headers(
+                    p_username, p_password, 'application/octet-stream'))
+        except InfluxDBClientError as _iex:
+            # The database was dropped, e.g. InfluxDB was reinitialised: it
+            # is checked, and created, again by the next request
+            if _iex.code == 404:
+                self._databases.discard(p_params.get('db'))
+            raise
+
+
+class InfluxDBRouter(object):
+    """
+    Maps each station to `replicas` distinct InfluxDB targets by consistent
+    hashing of the station ID, so that adding or removing a target moves only
+    the stations of that target.
+    """
+
+    # Points of each target on the hash ring
+    VNODES = 64
+
+    # Maximum number of cached routes, bounding the cache size when the
+    # stations send unexpected IDs
+    MAX_ROUTES = 4096
+
+    def __init__(self, targets, replicas=INFLUXDB_REPLICAS,
+                 max_routes=MAX_ROUTES):
+        self.targets = targets
+        self.replicas = max(1, min(replicas, len(targets)))
+        self._max_routes = max_routes
+
+        self._ring = sorted(
+            (self._hash('{}#{:d}'.format(_target, _i)), _index)
+            for _index, _target in enumerate(targets)
+            for _i in range(self.VNODES))
+        self._keys = [_key for _key, _ in self._ring]
+        self._routes = {}
+
+    @staticmethod
+    def _hash(p_key):
+        return int(hashlib.md5(p_key.encode()).hexdigest()[:16], 16)
+
+    def route(self, p_station):
+        try:
+            return self._routes[p_station]
+        except KeyError:
+            pass
+
+        _targets = []
+        _i = bisect.bisect(self._keys, self._hash(p_station))
+        while len(_targets) < self.replicas:
+            _target = self.targets[self._ring[_i % len(self._ring)][1]]
+            if _target not in _targets:
+                _targets.append(_target)
+            _i += 1
+
+        if len(self._routes) < self._max_routes:
+            self._routes[p_station] = _targets
+        return _targets
+
+    def batches(self, p_data):
+        """
+        Groups the points of p_data by target and returns the list of
+        (target, points) pairs.
+        """
+        if len(self.targets) == 1:
+            return [(self.targets[0], p_data)]
+
+        if isinstance(p_data, bytes):
+            p_data = p_data.decode()
+
+        v_batches = collections.OrderedDict()
+        for _point in p_data.splitlines():
+            if not _point.strip():
+                continue
+
+            # The station ID is the value of the first tag
+            _tags = _point.split(' ', 1)[0].split(',')
+            _station_id = _tags[1].partition('=')[2] if len(_tags) > 1 else ''
+
+            for _target in self.route(_station_id):
+                v_batches.setdefault(_target, []).append(_point)
+
+        if not v_batches:
+            return [(self.targets[0], p_data)]
+
+        return [(_target, '\n'.join(_points))
+                for _target, _points in v_batches.items()]
+
+
+class DispatchThreads(object):
+    """
+    Runs each submitted call on a thread of its own and returns a Future of
+    its result.  The server already uses a thread per request: the calls of
+    a request never wait behind those of the other requests, as they would
+    in a shared pool of threads.
+    """
+
+    def submit(self, p_function, *p_args):
+        v_future = Future()
+
+        def _run():
+            if not v_future.set_running_or_notify_cancel():
+                return
+            try:
+                v_future.set_result(p_function(*p_args))
+            except BaseException as _ex:
+                v_future.set_exception(_ex)
 
-        _dbs = _client.get_list_database()
-        if _db not in [_d['name'] for _d in _dbs]:
-            v_logger.info(
-                "InfluxDB database '{:s}' not found. Creating a new one.".
-                format(_db))
-            _client.create_database(_db)
+        threading.Thread(target=_run, name='dispatch', daemon=True).start()
+        return v_future
 
-    except InfluxDBClientError as _iex:
-        v_logger.error('InfluDB return code {}: {}'.
-                       format(_iex.code, _iex.content.rstrip()))
-        _response = flask.make_response(_iex.content, _iex.code)
-        return _response
 
+def write_batch(p_target, p_username, p_password, p_params, p_data, p_logger):
+    """
+    Writes the points to the target and returns the content and the status
+    code of the InfluxDB response.
+    """
     try:
-        v_logger.debug("Insert data into InfluxDB: {:s}".format(str(_data)))
-        _result = _client.request(
-            'write',
-            'POST',
-            params=_args,
-            data=_data,
-            expected_response_code=204)
-        _response = flask.make_response(_result.text, _result.status_code)
+        p_logger.debug("Insert data into InfluxDB {}: {:s}".format(
+            p_target, str(p_data)))
+        _result = p_target.write(p_username, p_password, p_params, p_data)
+        return _result.text, _result.status_code
     except InfluxDBClientError as _iex:
-        v_logger.error(_iex)
-        _response = flask.make_response(_iex.content, _iex.code)
+        p_logger.error(_iex)
+        return _iex.content, _iex.code
     except Exception as _ex:
-        v_logger.error(_ex)
-        _response = flask.make_response(_ex, 400)
-    finally:
-        _client.close()
+        p_logger.error(_ex)
+        return str(_ex), 400
+
+
+class FieldProjection(object):
+    """
+    Drops the fields of the points not selected by the include and exclude
+    rules.  A rule is either a field name (signal), a sensor model prefix
+    (SDS_*) or * for all the fields, optionally restricted to a measurement
+    (feinstaub/samples).  A field is kept if it matches an include rule, or
+    there are none, and no exclude rule.  The decision for each measurement
+    and field is computed once and then looked up.
+    """
+
+    # Maximum number of cached decisions, bounding the cache size when the
+    # stations send unexpected fields
+    MAX_DECISIONS = 4096
+
+    def __init__(self, include=(), exclude=(), max_decisions=MAX_DECISIONS):
+        self._include = self._compile(include)
+        self._exclude = self._compile(exclude)
+        self._include_all = not include
+        self._max_decisions = max_decisions
+
+        self._lock = threading.Lock()
+        self._decisions = {}
+
+        self.kept = 0
+        self.dropped = 0
+
+    @staticmethod
+    def _compile(p_rules):
+        _fields = set()
+        _models = set()
+        for _rule in p_rules:
+            _measurement, _, _field = _rule.rpartition('/')
+            _measurement = _measurement or '*'
+            if _field.endswith('_*'):
+                _models.add((_measurement, _field[:-2]))
+            else:
+                _fields.add((_measurement, _field))
+        return _fields, _models
+
+    @staticmethod
+    def _matches(p_rules, p_measurement, p_field, p_model):
+        _fields, _models = p_rules
+        return (
+            (p_measurement, p_field) in _fields or
+            ('*', p_field) in _fields or
+            (p_measurement, '*') in _fields or
+            ('*', '*') in _fields or
+            (p_measurement, p_model) in _models or
+            ('*', p_model) in _models)
+
+    def keep(self, p_measurement, p_field):
+        _key = (p_measurement, p_field)
+        try:
+            return self._decisions[_key]
+        except KeyError:
+            pass
+
+        # DHT22 fields come without the sensor model, see publish_messages()
+        if p_field in ['temperature', 'humidity']:
+            _model = 'DHT22'
+        else:
+            _model = p_field.partition('_')[0]
+
+        _keep = ((self._include_all or
+                  self._matches(self._include, p_measurement, p_field,
+                                _model)) and
+                 not self._matches(self._exclude, p_measurement, p_field,
+                                   _model))
+
+        if len(self._decisions) < self._max_decisions:
+            self._decisions[_key] = _keep
+        return _keep
+
+    def apply(self, p_data):
+        """
+        Returns the line protocol points of p_data without the dropped
+        fields, and the same points split as by parse_points().  Points left
+        without fields are removed.
+        """
+        if isinstance(p_data, bytes):
+            p_data = p_data.decode()
+
+        v_points = []
+        v_parsed = []
+        v_kept = 0
+        v_dropped = 0
+        for _point in p_data.splitlines():
+            _parts = _point.split(' ')
+            if len(_parts) < 2:
+                v_points.append(_point)
+                v_parsed.append(dict(zip(POINT_KEYS, _point.split())))
+                continue
+
+            _measurement = _parts[0].partition(',')[0]
+            _fields = _parts[1].split(',')
+            _kept = [_f for _f in _fields
+                     if self.keep(_measurement, _f.partition('=')[0])]
+
+            v_kept += len(_kept)
+            v_dropped += len(_fields) - len(_kept)
+
+            if _kept:
+                _parts[1] = ','.join(_kept)
+                v_points.append(' '.join(_parts))
+                v_parsed.append(dict(zip(POINT_KEYS, _parts)))
+
+        with self._lock:
+            self.kept += v_kept
+            self.dropped += v_dropped
+
+        return '\n'.join(v_points), v_parsed
+
+
+def publish_messages(p_payload, p_latitude, p_longitude, p_logger):
+    """
+    Converts the parsed InfluxDB points to WeatherObserved messages, one for
+    each sensor, and publishes them to the local MQTT broker.
+    """
+    v_mqtt_local_host = app.config['MQTT_LOCAL_HOST']
+    v_mqtt_local_port = app.config['MQTT_LOCAL_PORT']
+    v_topic = app.config['MQTT_TOPIC']
+
+    v_latitude = p_latitude
+    v_longitude = p_longitude
 
     v_messages = []
 
     try:
-        v_payload = flask.request.get_payload
-
         # Creates a dictionary with the sensor data
-        for v_measure in v_payload:
+        for v_measure in p_payload:
             _sensor_tree = dict()
 
             _tags = v_measure['tag_set']
@@ -231,7 +922,7 @@ def publish_data():
                     try:
                         _value = float(_value)
                     except ValueError:
-                        v_logger.error(
+                        p_logger.error(
                             'Parameter %s expected as float, %s got instead',
                             _parameter, _value)
 
@@ -266,16 +957,193 @@ def publish_data():
 
                 v_messages.append(_message)
 
-        v_logger.debug(
+        p_logger.debug(
             "Message topic:\'{:s}\', broker:\'{:s}:{:d}\', "
             "message:\'{:s}\'".format(
                 v_topic, v_mqtt_local_host, v_mqtt_local_port,
                 json.dumps(v_messages)))
-        publish.multiple(v_messages, hostname=v_mqtt_local_host,
-                         port=v_mqtt_local_port)
+
+        v_output = app.config.get('MQTT_OUTPUT')
+        if v_output is not None:
+            v_output.put(v_messages)
+        else:
+            publish.multiple(v_messages, hostname=v_mqtt_local_host,
+                             port=v_mqtt_local_port)
     except socket.error:
         pass
 
+
+@app.before_request
+def shed_load():
+    v_budget = app.config.get('MEMORY_BUDGET')
+    if v_budget is None or flask.request.endpoint != 'publish_data':
+        return None
+
+    if not v_budget.enter():
+        app.config['LOGGER'].warning(
+            'Memory budget exceeded: request refused.')
+        _response = flask.make_response(
+            'Memory budget exceeded, retry later.', 503)
+        _response.headers['Retry-After'] = '1'
+        return _response
+
+    flask.g.memory_budget = v_budget
+    return None
+
+
+@app.teardown_request
+def release_load(p_exception):
+    v_budget = flask.g.pop('memory_budget', None)
+    if v_budget is not None:
+        v_budget.leave()
+
+
+@app.route("/debug/memory", methods=['GET'])
+def dump_memory():
+    if not app.config.get('DEBUG_ROUTES'):
+        flask.abort(404)
+
+    v_top = flask.request.args.get(
+        'top', default=app.config.get('MEMORY_TOP', MEMORY_TOP), type=int)
+    return flask.jsonify(memory_report(v_top))
+
+
+@app.route("/debug/fields", methods=['GET'])
+def dump_fields():
+    if not app.config.get('DEBUG_ROUTES'):
+        flask.abort(404)
+
+    v_projection = app.config.get('FIELD_PROJECTION')
+    if v_projection is None:
+        return flask.jsonify({'kept': None, 'dropped': None})
+    return flask.jsonify(
+        {'kept': v_projection.kept, 'dropped': v_projection.dropped})
+
+
+@app.route("/write", methods=['POST'])
+def publish_data():
+    v_arrival = time.time()
+    v_logger = app.config['LOGGER']
+
+    v_capture = app.config.get('CAPTURE')
+    if v_capture is not None:
+        v_capture.record(flask.request, v_arrival)
+
+    v_latitude = app.config['LATITUDE']
+    v_longitude = app.config['LONGITUDE']
+
+    _data = flask.request.get_data()
+    _args = flask.request.args.to_dict()
+    _auth = flask.request.authorization
+    _db = _args.get('db')
+
+    # The required 'db' must match the configured db
+    if _db != app.config['INFLUXDB_DB']:
+        v_logger.error('Query not allowed: invalid db.')
+        _response = flask.make_response('Query not allowed: invalid db.', 400)
+        return _response
+
+    if _auth is None:
+        _db_username = None
+        _db_password = None
+    else:
+        _db_username = _auth['username']
+        _db_password = _auth['password']
+
+    # Ok, a dirty hack
+    # In presence of a GPS module, SDFS sends GPS date and time as unquoted
+    # strings and they cannot be saved to Influxdb.  Here these values are
+    # removed from the message and replaced by a ISO format time string
+    _m, _f = _data.decode().split(' ')
+    _gps_dts = {
+        _i.split('=')[0]: _i.split('=')[1]
+        for _i in _f.split(',')
+        if _i.startswith('GPS_')
+    }
+
+    if _gps_dts:
+        # Old firmware sends GPS data/time as two different keys
+        if 'GPS_data' in [*_gps_dts]:
+            _nmea_gps_format = '%m/%d/%Y-%H:%M:%S.%f'
+            _nmea_gps_string = '{:s}-{:s}'.format(
+                _gps_dts['GPS_date'], _gps_dts['GPS_time'])
+            _gps_dt = datetime.datetime.strptime(
+                _nmea_gps_string, _nmea_gps_format)
+            _influx_gps_time = 'GPS_time="{:%Y-%m-%dT%H:%M:%SZ}"'.format(_gps_dt)
+
+            _new_f = [_i for _i in _f.split(',')
+                      if not _i.startswith('GPS_date') and not
+                      _i.startswith('GPS_time')]
+
+            _new_f.insert(0, _influx_gps_time)
+            _new_f = ','.join(_new_f)
+            _data = ' '.join([_m, _new_f])
+
+    # The unused fields are dropped before both the InfluxDB write and the
+    # MQTT translation, which uses the points already split by the projection
+    v_projection = app.config.get('FIELD_PROJECTION')
+    if v_projection is None:
+        v_payload = flask.request.get_payload
+    else:
+        _data, _points = v_projection.apply(_data)
+        if not _data:
+            v_logger.debug('All the fields dropped: nothing to write.')
+            return flask.make_response('', 204)
+
+        v_payload = None
+        _content_type = flask.request.headers.get('content-type')
+        if _content_type == flask.request.FORM_CONTENT_TYPE:
+            v_payload = _points
+
+    v_router = app.config['INFLUXDB_ROUTER']
+    v_batches = v_router.batches(_data)
+
+    try:
+        for _target, _ in v_batches:
+            _target.check_database(
+                _db_username, _db_password, _db, v_logger)
+
+    except InfluxDBClientError as _iex:
+        v_logger.error('InfluDB return code {}: {}'.
+                       format(_iex.code, _iex.content.rstrip()))
+        _response = flask.make_response(_iex.content, _iex.code)
+        return _response
+
+    v_mqtt = None
+    v_executor = app.config.get('EXECUTOR')
+    if v_executor is not None:
+        # The MQTT messages depend only on the request body: they are built
+        # and published while the data is written to InfluxDB.
+        v_mqtt = v_executor.submit(
+            publish_messages, v_payload, v_latitude, v_longitude, v_logger)
+
+    # The batches of the other targets are written in parallel with the first
+    v_writes = []
+    for _target, _batch in v_batches[1:]:
+        _write_args = (_target, _db_username, _db_password, _args, _batch,
+                       v_logger)
+        if v_executor is not None:
+            v_writes.append(v_executor.submit(write_batch, *_write_args))
+        else:
+            v_writes.append(write_batch(*_write_args))
+
+    _target, _batch = v_batches[0]
+    v_results = [write_batch(
+        _target, _db_username, _db_password, _args, _batch, v_logger)]
+    v_results.extend(
+        _w.result() if v_executor is not None else _w for _w in v_writes)
+
+    # Replies with the first failure, if any
+    _content, _code = next(
+        (_r for _r in v_results if _r[1] // 100 != 2), v_results[0])
+    _response = flask.make_response(_content, _code)
+
+    if v_mqtt is None:
+        publish_messages(v_payload, v_latitude, v_longitude, v_logger)
+    else:
+        # Re-raises the exceptions of the MQTT publication, if any
+        v_mqtt.result()
+
     return _response
 
 
@@ -283,6 +1151,23 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 
+def memory_signal_handler(sig, frame):
+    v_report = memory_report(app.config.get('MEMORY_TOP', MEMORY_TOP))
+    app.config['LOGGER'].info('Memory report: {:s}'.format(
+        json.dumps(v_report)))
+
+
+def str_to_bool(p_value):
+    """
+    Converts the boolean values accepted by configparser.
+    """
+    try:
+        return configparser.ConfigParser.BOOLEAN_STATES[str(p_value).lower()]
+    except KeyError:
+        raise argparse.ArgumentTypeError(
+            'boolean value expected, got {}'.format(p_value))
+
+
 def configuration_parser(p_args=None):
     pre_parser = argparse.ArgumentParser(add_help=False)
 
@@ -304,6 +1189,21 @@ def configuration_parser(p_args=None):
     }
 
     v_specific_config_defaults = {
+        'influxdb_targets'     : INFLUXDB_TARGETS,
+        'influxdb_replicas'    : INFLUXDB_REPLICAS,
+        'concurrent_dispatch'  : CONCURRENT_DISPATCH,
+        'mqtt_tick'            : MQTT_TICK,
+        'mqtt_collapse'        : False,
+        'mqtt_inflight'        : MQTT_INFLIGHT,
+        'memory_budget'        : MEMORY_BUDGET,
+        'memory_trace'         : False,
+        'memory_top'           : MEMORY_TOP,
+        'debug_routes'         : False,
+        'field_include'        : FIELD_INCLUDE,
+        'field_exclude'        : FIELD_EXCLUDE,
+        'capture_file'         : CAPTURE_FILE,
+        'capture_max_bytes'    : CAPTURE_MAX_BYTES,
+        'capture_backup_count' : CAPTURE_BACKUP_COUNT,
     }
 
     v_config_section_defaults = {
@@ -371,11 +1271,201 @@ def configuration_parser(p_args=None):
         type=str,
         help=('GPS coordinates of the sensor as latitude,longitude '
               '(default: {})').format(GPS_LOCATION))
+    parser.add_argument(
+        '--influxdb-targets', dest='influxdb_targets', action='store',
+        type=str,
+        help=('comma separated list of host:port of the influx databases the '
+              'stations are spread across (default: the influxdb host and '
+              'port)'))
+    parser.add_argument(
+        '--influxdb-replicas', dest='influxdb_replicas', action='store',
+        type=int,
+        help=('number of influx databases written for each station '
+              '(default: {})').format(INFLUXDB_REPLICAS))
+    parser.add_argument(
+        '--concurrent-dispatch', dest='concurrent_dispatch', action='store',
+        type=str_to_bool, nargs='?', const=True,
+        help=('publish the MQTT messages and write to the other influx '
+              'databases, each on a thread of its own, while the data is '
+              'written to the first one, otherwise do it sequentially '
+              '(default: {})').format(CONCURRENT_DISPATCH))
+    parser.add_argument(
+        '--mqtt-tick', dest='mqtt_tick', action='store',
+        type=float,
+        help=('collect the MQTT messages of all the requests and publish them '
+              'together every MQTT_TICK seconds, 0 to publish each request on '
+              'its own (default: {})').format(MQTT_TICK))
+    parser.add_argument(
+        '--mqtt-collapse', dest='mqtt_collapse', action='store',
+        type=str_to_bool, nargs='?', const=True,
+        help=('publish only the latest message for each topic in a tick '
+              '(default: False)'))
+    parser.add_argument(
+        '--mqtt-inflight', dest='mqtt_inflight', action='store',
+        type=int,
+        help=('maximum number of QoS 1 messages awaiting acknowledgement '
+              '(default: {})').format(MQTT_INFLIGHT))
+    parser.add_argument(
+        '--memory-budget', dest='memory_budget', action='store',
+        type=int,
+        help=('memory in MiB the handler may use on top of its memory at '
+              'startup: the buffers and queues are sized from it and the '
+              'requests are refused while the accounted memory or the '
+              'measured growth is above {:.0f}%% of it until below '
+              '{:.0f}%%, 0 to disable '
+              '(default: {})').format(
+                  100 * MEMORY_SHED_RATIO, 100 * MEMORY_RESUME_RATIO,
+                  MEMORY_BUDGET))
+    parser.add_argument(
+        '--memory-trace', dest='memory_trace', action='store',
+        type=str_to_bool, nargs='?', const=True,
+        help=('trace the memory allocations with tracemalloc for the memory '
+              'reports (default: False)'))
+    parser.add_argument(
+        '--memory-top', dest='memory_top', action='store',
+        type=int,
+        help=('number of allocation sites listed in the memory reports '
+              '(default: {})').format(MEMORY_TOP))
+    parser.add_argument(
+        '--debug-routes', dest='debug_routes', action='store',
+        type=str_to_bool, nargs='?', const=True,
+        help=('serve the memory report on /debug/memory, which is '
+              'otherwise only logged on SIGUSR1, and the field projection '
+              'counters on /debug/fields (default: False)'))
+    parser.add_argument(
+        '--field-include', dest='field_include', action='store',
+        type=str,
+        help=('comma separated rules of the fields written and published, as '
+              '[measurement/]field or [measurement/]model_* (default: all)'))
+    parser.add_argument(
+        '--field-exclude', dest='field_exclude', action='store',
+        type=str,
+        help=('comma separated rules of the fields dropped, as '
+              '[measurement/]field or [measurement/]model_* (default: none)'))
+    parser.add_argument(
+        '--capture-file', dest='capture_file', action='store',
+        type=str,
+        help=('record the incoming requests to this gzip compressed file for '
+              'later replay (default: disabled)'))
+    parser.add_argument(
+        '--capture-max-bytes', dest='capture_max_bytes', action='store',
+        type=int,
+        help=('rotate the capture file after this many uncompressed bytes, '
+              '0 to never rotate (default: {})').format(CAPTURE_MAX_BYTES))
+    parser.add_argument(
+        '--capture-backup-count', dest='capture_backup_count',
+        action='store', type=int,
+        help='number of rotated capture files to keep (default: {})'.format(
+            CAPTURE_BACKUP_COUNT))
 
     args = parser.parse_args(remaining_args)
     return args
 
 
+def application_config(p_args, p_logger):
+    """
+    Builds the Flask configuration mapping from the parsed options.
+    """
+    v_mqtt_topic = 'sensor/' + 'FEINSTAUB'
+    v_latitude, v_longitude = map(float, p_args.gps_location.split(','))
+
+    if p_args.memory_trace and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    v_budget = None
+    v_mqtt_max_queued = MQTT_MAX_QUEUED
+    v_capture_buffer_size = CAPTURE_BUFFER_SIZE
+    v_max_routes = InfluxDBRouter.MAX_ROUTES
+    v_max_decisions = FieldProjection.MAX_DECISIONS
+    if p_args.memory_budget > 0:
+        v_budget = MemoryBudget(p_args.memory_budget * 1024 * 1024)
+
+        # The MQTT messages waiting for the tick and those queued by paho
+        # are allowed 5% of the budget each, the capture buffer 1%
+        v_mqtt_max_queued = v_budget.items(
+            0.05, MQTT_MESSAGE_SIZE, MQTT_MAX_QUEUED)
+        v_capture_buffer_size = v_budget.items(0.01, 1, CAPTURE_BUFFER_SIZE)
+
+        # A cached route, with the station ID, takes about 256 bytes
+        v_max_routes = v_budget.items(0.01, 256, InfluxDBRouter.MAX_ROUTES)
+
+        # So does a cached field decision, with the measurement and field
+        v_max_decisions = v_budget.items(
+            0.01, 256, FieldProjection.MAX_DECISIONS)
+
+    v_targets = []
+    for _target in p_args.influxdb_targets.split(','):
+        _host, _, _port = _target.strip().partition(':')
+        if _host:
+            v_targets.append(InfluxDBTarget(
+                _host, int(_port) if _port else INFLUXDB_PORT))
+    if not v_targets:
+        v_targets.append(
+            InfluxDBTarget(p_args.influxdb_host, p_args.influxdb_port))
+
+    v_router = InfluxDBRouter(
+        v_targets, p_args.influxdb_replicas, v_max_routes)
+
+    v_projection = None
+    v_include = [_r for _r in re.split(r'[,\s]+', p_args.field_include) if _r]
+    v_exclude = [_r for _r in re.split(r'[,\s]+', p_args.field_exclude) if _r]
+    if v_include or v_exclude:
+        v_projection = FieldProjection(v_include, v_exclude, v_max_decisions)
+
+    v_executor = None
+    if p_args.concurrent_dispatch:
+        v_executor = DispatchThreads()
+
+    v_mqtt_output = None
+    if p_args.mqtt_tick > 0:
+        v_mqtt_output = MQTTOutputStage(
+            p_args.mqtt_local_host, p_args.mqtt_local_port, p_args.mqtt_tick,
+            collapse=p_args.mqtt_collapse, inflight=p_args.mqtt_inflight,
+            max_queued=v_mqtt_max_queued, logger=p_logger)
+        atexit.register(v_mqtt_output.close)
+        if v_budget is not None:
+            v_budget.account(v_mqtt_output.held_bytes)
+
+    v_capture = None
+    if p_args.capture_file:
+        v_capture = CaptureWriter(
+            p_args.capture_file,
+            max_bytes=p_args.capture_max_bytes,
+            backup_count=p_args.capture_backup_count,
+            buffer_size=v_capture_buffer_size)
+        atexit.register(v_capture.close)
+        if v_budget is not None:
+            v_budget.account(v_capture.held_bytes)
+        p_logger.info(
+            "Capturing requests to '{:s}'".format(p_args.capture_file))
+
+    config_dict = {
+        'LOGGER'     : p_logger,
+        'MQTT_LOCAL_HOST'  : p_args.mqtt_local_host,
+        'MQTT_LOCAL_PORT'  : p_args.mqtt_local_port,
+        'LOG_LEVEL'  : p_args.logging_level,
+        'MQTT_TOPIC' : v_mqtt_topic,
+
+        'INFLUXDB_DB' : p_args.influxdb_db,
+        'INFLUXDB_HOST' : p_args.influxdb_host,
+        'INFLUXDB_PORT' : p_args.influxdb_port,
+        'INFLUXDB_ROUTER' : v_router,
+
+        'LATITUDE'  : v_latitude,
+        'LONGITUDE' : v_longitude,
+
+        'EXECUTOR' : v_executor,
+        'MQTT_OUTPUT' : v_mqtt_output,
+        'FIELD_PROJECTION' : v_projection,
+        'MEMORY_BUDGET' : v_budget,
+        'MEMORY_TOP' : p_args.memory_top,
+        'DEBUG_ROUTES' : p_args.debug_routes,
+        'CAPTURE' : v_capture,
+    }
+
+    return config_dict
+
+
 def main():
     # Initializes the default logger
     logging.basicConfig(
@@ -392,27 +1482,13 @@ def main():
 
     logger.setLevel(args.logging_level)
 
+    # SIGTERM is sent by 'docker stop': exiting through sys.exit() runs the
+    # atexit hooks flushing the capture file and the MQTT output stage
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGUSR1, memory_signal_handler)
 
-    v_mqtt_topic = 'sensor/' + 'FEINSTAUB'
-    v_latitude, v_longitude = map(float, args.gps_location.split(','))
-
-    config_dict = {
-        'LOGGER'     : logger,
-        'MQTT_LOCAL_HOST'  : args.mqtt_local_host,
-        'MQTT_LOCAL_PORT'  : args.mqtt_local_port,
-        'LOG_LEVEL'  : args.logging_level,
-        'MQTT_TOPIC' : v_mqtt_topic,
-
-        'INFLUXDB_DB' : args.influxdb_db,
-        'INFLUXDB_HOST' : args.influxdb_host,
-        'INFLUXDB_PORT' : args.influxdb_port,
-
-        'LATITUDE'  : v_latitude,
-        'LONGITUDE' : v_longitude,
-    }
-
-    app.config.from_mapping(config_dict)
+    app.config.from_mapping(application_config(args, logger))
     app.request_class = INFLUXDBRequest
     app.run(host='0.0.0.0')
 
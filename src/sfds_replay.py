@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Replays the traffic recorded by the Feinstaub Publisher with the
+--capture-file option and reports throughput and latency.
+
+By default the requests are sent to an in-process instance of the handler
+whose InfluxDB and MQTT backends are replaced by local stand-ins, so that a
+capture taken on a gateway can be used as a regression benchmark anywhere.
+With --url the requests are sent to a running handler instead.
+"""
+
+import sys
+import gzip
+import json
+import time
+import logging
+import argparse
+import threading
+import collections
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+import feinstaub_publisher
+
+
+REPLAY_SPEED = 1.0      # 1.0 keeps the original timing, 0 as fast as possible
+REPLAY_WORKERS = 1      # Number of requests in flight at the same time
+
+
+class StandInResponse(collections.namedtuple(
+        'StandInResponse', ['text', 'status_code'])):
+    """
+    Replaces requests.Response: the queries return no series.
+    """
+
+    def json(self):
+        return {'results': [{}]}
+
+
+class StandInInfluxDBClient(object):
+    """
+    Replaces influxdb.InfluxDBClient: every database is created and every
+    write is accepted after `latency` seconds.
+    """
+    latency = 0.0
+
+    def __init__(self, host=None, port=None, **kwargs):
+        pass
+
+    def request(self, url, method='GET', params=None, data=None,
+                expected_response_code=200, **kwargs):
+        if url == 'query':
+            return StandInResponse('', 200)
+        time.sleep(self.latency)
+        return StandInResponse('', 204)
+
+    def close(self):
+        pass
+
+
+class StandInPublisher(object):
+    """
+    Replaces paho.mqtt.publish.multiple, which opens a connection for each
+    call: the messages are counted and dropped after `latency` seconds.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.messages = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def multiple(self, msgs, hostname='localhost', port=1883, **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            self.messages += len(msgs)
+            self.connections += 1
+
+    def client(self, *args, **kwargs):
+        return StandInMQTTClient(self)
+
+
+class StandInMessageInfo(object):
+    """
+    Replaces paho.mqtt.client.MQTTMessageInfo: every message is acknowledged.
+    """
+
+    def __init__(self, rc):
+        self.rc = rc
+
+    def is_published(self):
+        return True
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+
+class StandInMQTTClient(object):
+    """
+    Replaces paho.mqtt.client.Client for the MQTT output stage: the published
+    messages are counted by the stand-in publisher and dropped.
+    """
+
+    def __init__(self, p_publisher):
+        self._publisher = p_publisher
+
+    def max_inflight_messages_set(self, inflight):
+        pass
+
+    def max_queued_messages_set(self, queue_size):
+        pass
+
+    def connect_async(self, host, port=1883, **kwargs):
+        with self._publisher._lock:
+            self._publisher.connections += 1
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def publish(self, topic, payload=None, qos=0, retain=False, **kwargs):
+        with self._publisher._lock:
+            self._publisher.messages += 1
+        return StandInMessageInfo(0)
+
+
+def install_stand_ins(p_influxdb_latency=0.0, p_mqtt_latency=0.0):
+    """
+    Replaces the backends used by the handler with the local stand-ins.
+    """
+    StandInInfluxDBClient.latency = p_influxdb_latency
+    v_publisher = StandInPublisher(p_mqtt_latency)
+
+    feinstaub_publisher.influxdb.InfluxDBClient = StandInInfluxDBClient
+    feinstaub_publisher.publish.multiple = v_publisher.multiple
+    feinstaub_publisher.mqtt.Client = v_publisher.client
+
+    return v_publisher
+
+
+class InProcessSender(object):
+    """
+    Sends the captured requests to the handler application through the Flask
+    test client.
+    """
+
+    def __init__(self, p_config_file=None, p_options=None):
+        _cmd_line = ['-c', p_config_file] if p_config_file else []
+        _args = feinstaub_publisher.configuration_parser(_cmd_line)
+
+        # Options overridden by the caller, e.g. by the benchmarks
+        for _option, _value in (p_options or {}).items():
+            setattr(_args, _option, _value)
+
+        # Never capture the replayed traffic
+        _args.capture_file = ''
+
+        _logger = logging.getLogger(feinstaub_publisher.APPLICATION_NAME)
+        _logger.setLevel(logging.WARNING)
+
+        self._app = feinstaub_publisher.app
+        self._app.config.from_mapping(
+            feinstaub_publisher.application_config(_args, _logger))
+        self._app.request_class = feinstaub_publisher.INFLUXDBRequest
+
+        self._local = threading.local()
+
+    def send(self, p_record):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self._app.test_client()
+
+        _response = self._local.client.post(
+            '/write',
+            query_string=p_record['args'],
+            headers=p_record['headers'],
+            data=p_record['body'].encode('latin-1'))
+        return _response.status_code
+
+
+class HTTPSender(object):
+    """
+    Sends the captured requests to a running handler.
+    """
+
+    def __init__(self, p_url):
+        self._url = p_url.rstrip('/') + '/write'
+        self._local = threading.local()
+
+    def send(self, p_record):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+
+        _response = self._local.session.post(
+            self._url,
+            params=p_record['args'],
+            headers=p_record['headers'],
+            data=p_record['body'].encode('latin-1'))
+        return _response.status_code
+
+
+def read_captures(p_files):
+    """
+    Yields the records of the capture files in the given order, the oldest
+    rotated file should be listed first.
+    """
+    for _file in p_files:
+        with gzip.open(_file, 'rt', encoding='latin-1') as _f:
+            for _line in _f:
+                if _line.strip():
+                    yield json.loads(_line)
+
+
+def synthetic_records(p_count, p_stations=10, p_interval=1.0):
+    """
+    Generates SFDS-like requests, as read from a capture file, sent by
+    p_stations stations in turn p_interval seconds apart.
+    """
+    for _i in range(p_count):
+        yield {
+            'time': _i * p_interval,
+            'args': {'db': 'luftdaten'},
+            'headers': {
+                'Content-Type': 'application/x-www-form-urlencoded'},
+            'body': ('feinstaub,node=esp8266-{:d} '
+                     'SDS_P1={:.1f},SDS_P2={:.1f},temperature=21.5,'
+                     'humidity=48.0,BME280_pressure=101325.0,'
+                     'signal=-71'.format(_i % p_stations, _i % 50, _i % 25))
+        }
+
+
+def replay(p_records, p_sender, p_speed=REPLAY_SPEED,
+           p_workers=REPLAY_WORKERS):
+    """
+    Sends the records with their original spacing divided by p_speed (or as
+    fast as possible when p_speed is 0) and returns the list of
+    (latency, status code, lag) of each request and the total elapsed time.
+
+    With p_speed greater than 0 the latency is measured from the time the
+    request was scheduled, so that the time spent waiting for a free worker
+    when the handler falls behind is not left out, and the lag is how late
+    the request was actually sent.  As fast as possible, the latency is
+    measured from the time the request is sent and the lag is 0.
+    """
+    v_results = []
+    v_lock = threading.Lock()
+
+    def _send(p_record, p_scheduled):
+        _start = time.perf_counter()
+        if p_scheduled is None:
+            p_scheduled = _start
+        try:
+            _status = p_sender.send(p_record)
+        except Exception:
+            _status = None
+        _latency = time.perf_counter() - p_scheduled
+
+        with v_lock:
+            v_results.append((_latency, _status, _start - p_scheduled))
+
+    v_first = None
+    v_start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=p_workers) as _pool:
+        for _record in p_records:
+            _scheduled = None
+            if p_speed > 0:
+                if v_first is None:
+                    v_first = _record['time']
+                _scheduled = v_start + (_record['time'] - v_first) / p_speed
+                _delay = _scheduled - time.perf_counter()
+                if _delay > 0:
+                    time.sleep(_delay)
+
+            _pool.submit(_send, _record, _scheduled)
+
+    v_elapsed = time.perf_counter() - v_start
+
+    return v_results, v_elapsed
+
+
+def percentile(p_values, p_percent):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not p_values:
+        return 0.0
+    _rank = max(int(round(p_percent / 100.0 * len(p_values))) - 1, 0)
+    return p_values[min(_rank, len(p_values) - 1)]
+
+
+def report(p_results, p_elapsed, p_stream=sys.stdout):
+    v_latencies = sorted(_r[0] for _r in p_results)
+    v_lags = sorted(_r[2] for _r in p_results)
+    v_statuses = collections.Counter(_r[1] for _r in p_results)
+
+    v_count = len(p_results)
+    v_throughput = v_count / p_elapsed if p_elapsed > 0 else 0.0
+
+    p_stream.write('requests   : {:d}\n'.format(v_count))
+    p_stream.write('elapsed    : {:.3f} s\n'.format(p_elapsed))
+    p_stream.write('throughput : {:.1f} req/s\n'.format(v_throughput))
+    if v_count:
+        p_stream.write('latency    : mean {:.2f} ms, p50 {:.2f} ms, '
+                       'p90 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms\n'.format(
+                           1000 * sum(v_latencies) / v_count,
+                           1000 * percentile(v_latencies, 50),
+                           1000 * percentile(v_latencies, 90),
+                           1000 * percentile(v_latencies, 99),
+                           1000 * v_latencies[-1]))
+        p_stream.write('behind     : mean {:.2f} ms, p99 {:.2f} ms, '
+                       'max {:.2f} ms\n'.format(
+                           1000 * sum(v_lags) / v_count,
+                           1000 * percentile(v_lags, 99),
+                           1000 * v_lags[-1]))
+    for _status, _count in sorted(
+            v_statuses.items(), key=lambda _i: str(_i[0])):
+        p_stream.write('status {:>4s} : {:d}\n'.format(
+            str(_status) if _status is not None else 'err', _count))
+
+
+def configuration_parser(p_args=None):
+    parser = argparse.ArgumentParser(
+        description=('Replays a Feinstaub Publisher traffic capture and '
+                     'reports throughput and latency.'))
+
+    parser.add_argument(
+        'captures', metavar='CAPTURE', nargs='+',
+        help='capture files to replay, oldest first')
+    parser.add_argument(
+        '-c', '--config-file', dest='config_file', action='store',
+        type=str, metavar='FILE',
+        help='config file of the in-process handler')
+    parser.add_argument(
+        '--url', dest='url', action='store', type=str,
+        help=('base URL of a running handler, the in-process handler with '
+              'stand-in backends is used if not given'))
+    parser.add_argument(
+        '--speed', dest='speed', action='store', type=float,
+        default=REPLAY_SPEED,
+        help=('replay speed factor, 0 for as fast as possible '
+              '(default: {})').format(REPLAY_SPEED))
+    parser.add_argument(
+        '--workers', dest='workers', action='store', type=int,
+        default=REPLAY_WORKERS,
+        help='number of concurrent requests (default: {})'.format(
+            REPLAY_WORKERS))
+    parser.add_argument(
+        '--influxdb-latency', dest='influxdb_latency', action='store',
+        type=float, default=0.0,
+        help='seconds taken by each stand-in InfluxDB write (default: 0)')
+    parser.add_argument(
+        '--mqtt-latency', dest='mqtt_latency', action='store',
+        type=float, default=0.0,
+        help='seconds taken by each stand-in MQTT publish (default: 0)')
+
+    return parser.parse_args(p_args)
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.WARNING)
+
+    args = configuration_parser()
+
+    if args.url:
+        v_sender = HTTPSender(args.url)
+    else:
+        install_stand_ins(args.influxdb_latency, args.mqtt_latency)
+        v_sender = InProcessSender(args.config_file)
+
+    v_results, v_elapsed = replay(
+        read_captures(args.captures), v_sender, args.speed, args.workers)
+    report(v_results, v_elapsed)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:ts=4:expandtab
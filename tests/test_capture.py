@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * that the traffic capture records the incoming requests and rotates the
+    capture file;
+    * that the /write route records the requests it receives;
+    * that the replay tool reads the capture files back in order and keeps
+    their timing.
+"""
+
+import os
+import gzip
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+
+from unittest.mock import Mock, patch
+from feinstaub_publisher import app, INFLUXDBRequest, CaptureWriter
+from feinstaub_publisher import InfluxDBTarget, InfluxDBRouter
+from sfds_replay import read_captures, percentile, replay
+
+
+def _request(p_body, p_args=None, p_headers=None):
+    _request = Mock()
+    _request.args.to_dict.return_value = p_args or {'db': 'luftdaten'}
+    _request.headers = p_headers or {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'Authorization': 'Basic c2VjcmV0'}
+    _request.get_data.return_value = p_body
+    return _request
+
+
+class TestCaptureWriter(unittest.TestCase):
+    """
+    Tests the capture file writer and reader.
+    """
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._capture_file = os.path.join(self._dir, 'capture.gz')
+
+    def test_record(self):
+        """
+        Tests that the records are written once the writer is closed and that
+        they are read back unchanged.
+        """
+        _writer = CaptureWriter(self._capture_file)
+        _writer.record(_request(b'feinstaub,node=esp8266-1 SDS_P1=1.0'), 10.0)
+        _writer.record(_request(b'feinstaub,node=esp8266-1 SDS_P1=2.0'), 11.5)
+
+        # Still buffered
+        self.assertFalse(os.path.exists(self._capture_file))
+
+        _writer.close()
+
+        _records = list(read_captures([self._capture_file]))
+        self.assertEqual(2, len(_records))
+        self.assertEqual(10.0, _records[0]['time'])
+        self.assertEqual(11.5, _records[1]['time'])
+        self.assertEqual({'db': 'luftdaten'}, _records[0]['args'])
+        self.assertEqual(
+            'feinstaub,node=esp8266-1 SDS_P1=2.0', _records[1]['body'])
+        self.assertEqual(
+            {'Content-Type': 'application/x-www-form-urlencoded'},
+            _records[0]['headers'])
+
+    def test_rotation(self):
+        """
+        Tests that the capture file is rotated and that only backup_count
+        rotated files are kept.
+        """
+        _writer = CaptureWriter(
+            self._capture_file, max_bytes=1, backup_count=2, buffer_size=1)
+        for _i in range(4):
+            _writer.record(
+                _request('feinstaub SDS_P1={:d}'.format(_i).encode()), _i)
+        _writer.close()
+
+        self.assertFalse(os.path.exists(self._capture_file))
+        self.assertFalse(os.path.exists(self._capture_file + '.3'))
+
+        _records = list(read_captures(
+            [self._capture_file + '.2', self._capture_file + '.1']))
+        self.assertEqual([2, 3], [_r['time'] for _r in _records])
+
+    def test_restart(self):
+        """
+        Tests that the data already in the capture file counts towards the
+        rotation limit after a restart.
+        """
+        _writer = CaptureWriter(self._capture_file, buffer_size=1)
+        _writer.record(_request(b'feinstaub SDS_P1=1.0'), 1)
+        _writer.close()
+        with gzip.open(self._capture_file, 'rb') as _f:
+            _size = len(_f.read())
+
+        # One more record fits only if the existing data is not counted
+        _writer = CaptureWriter(
+            self._capture_file, max_bytes=_size + _size // 2, buffer_size=1)
+        _writer.record(_request(b'feinstaub SDS_P1=2.0'), 2)
+        _writer.close()
+
+        # The second record brings the file over the limit: rotated
+        self.assertFalse(os.path.exists(self._capture_file))
+        _records = list(read_captures([self._capture_file + '.1']))
+        self.assertEqual([1, 2], [_r['time'] for _r in _records])
+
+    def test_percentile(self):
+        """
+        Tests the nearest-rank percentile used by the replay report.
+        """
+        _values = list(range(1, 101))
+        self.assertEqual(50, percentile(_values, 50))
+        self.assertEqual(99, percentile(_values, 99))
+        self.assertEqual(1, percentile(_values, 0))
+        self.assertEqual(0.0, percentile([], 50))
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+
+class TestCaptureRoute(unittest.TestCase):
+    """
+    Tests the capture of the requests received on the /write route.
+    """
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._capture_file = os.path.join(self._dir, 'capture.gz')
+
+        _patcher = patch('feinstaub_publisher.influxdb.InfluxDBClient')
+        _client = _patcher.start().return_value
+        self.addCleanup(_patcher.stop)
+
+        _client.request.return_value.json.return_value = {
+            'results': [{'series': [{'values': [['luftdaten']]}]}]}
+        _client.request.return_value.text = ''
+        _client.request.return_value.status_code = 204
+
+        _patcher = patch('feinstaub_publisher.publish.multiple')
+        _patcher.start()
+        self.addCleanup(_patcher.stop)
+
+        self._capture = CaptureWriter(self._capture_file)
+        app.config.from_mapping({
+            'LOGGER': logging.getLogger('test'),
+            'INFLUXDB_DB': 'luftdaten',
+            'INFLUXDB_ROUTER': InfluxDBRouter(
+                [InfluxDBTarget('localhost', 8086)]),
+            'MQTT_LOCAL_HOST': 'localhost',
+            'MQTT_LOCAL_PORT': 1883,
+            'MQTT_TOPIC': 'sensor/FEINSTAUB',
+            'LATITUDE': 0.0,
+            'LONGITUDE': 0.0,
+            'EXECUTOR': None,
+            'CAPTURE': self._capture,
+        })
+        app.request_class = INFLUXDBRequest
+        self._test_client = app.test_client()
+
+    def test_write(self):
+        """
+        Tests that the query arguments, the selected headers and the raw body
+        are recorded, and the credentials are not.
+        """
+        _body = 'feinstaub,node=esp8266-città SDS_P1=1.0'.encode()
+
+        _response = self._test_client.post(
+            '/write?db=luftdaten&precision=s',
+            data=_body,
+            headers={
+                'Authorization': 'Basic dXNlcjpzZWNyZXQ=',
+                'User-Agent': 'NRZ-2020-129/esp8266-1',
+                'X-Sensor': 'esp8266-1',
+                'X-Other': 'not recorded'},
+            content_type='application/x-www-form-urlencoded')
+        self.assertEqual(204, _response.status_code)
+
+        self._capture.close()
+
+        _records = list(read_captures([self._capture_file]))
+        self.assertEqual(1, len(_records))
+        self.assertEqual(
+            {'db': 'luftdaten', 'precision': 's'}, _records[0]['args'])
+        self.assertEqual({
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'User-Agent': 'NRZ-2020-129/esp8266-1',
+            'X-Sensor': 'esp8266-1'}, _records[0]['headers'])
+        self.assertEqual(_body, _records[0]['body'].encode('latin-1'))
+
+    def tearDown(self):
+        app.config['CAPTURE'] = None
+        self._capture.close()
+        shutil.rmtree(self._dir)
+
+
+class TestReplay(unittest.TestCase):
+    """
+    Tests the timing of the replayed requests.
+    """
+
+    class _Sender(object):
+
+        def __init__(self, p_delay=0.0):
+            self.delay = p_delay
+            self.sent = []
+
+        def send(self, p_record):
+            self.sent.append(time.perf_counter())
+            time.sleep(self.delay)
+            return 204
+
+    @staticmethod
+    def _records(p_times):
+        return [{'time': _t, 'args': {}, 'headers': {}, 'body': ''}
+                for _t in p_times]
+
+    def test_speed(self):
+        """
+        Tests that the original spacing is divided by the speed factor.
+        """
+        _sender = self._Sender()
+        replay(self._records([100.0, 101.0, 103.0]), _sender, p_speed=10)
+
+        self.assertAlmostEqual(0.1, _sender.sent[1] - _sender.sent[0],
+                               delta=0.05)
+        self.assertAlmostEqual(0.3, _sender.sent[2] - _sender.sent[0],
+                               delta=0.05)
+
+    def test_as_fast_as_possible(self):
+        """
+        Tests that the spacing is ignored with speed 0.
+        """
+        _sender = self._Sender()
+        _results, _elapsed = replay(
+            self._records([0.0, 60.0, 120.0]), _sender, p_speed=0)
+
+        self.assertEqual(3, len(_results))
+        self.assertLess(_elapsed, 1.0)
+        self.assertEqual([0.0, 0.0, 0.0], [_r[2] for _r in _results])
+
+    def test_behind_schedule(self):
+        """
+        Tests that, when the handler is slower than the requests arrive, the
+        latency includes the time the requests waited to be sent.
+        """
+        _sender = self._Sender(0.05)
+        _results, _ = replay(
+            self._records([0.01 * _i for _i in range(5)]), _sender, p_speed=1)
+
+        # The last request is due after 40 ms and sent after 200 ms
+        _latency, _status, _lag = _results[-1]
+        self.assertEqual(204, _status)
+        self.assertGreater(_lag, 0.1)
+        self.assertGreater(_latency, _lag + 0.04)
+
+
+if __name__ == '__main__':
+    unittest.main()
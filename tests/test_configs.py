@@ -38,6 +38,19 @@ from feinstaub_publisher import (
     INFLUXDB_HOST,
     INFLUXDB_PORT,
     GPS_LOCATION)
+from feinstaub_publisher import (
+    INFLUXDB_TARGETS,
+    INFLUXDB_REPLICAS,
+    CONCURRENT_DISPATCH,
+    MQTT_TICK,
+    MQTT_INFLIGHT,
+    MEMORY_BUDGET,
+    MEMORY_TOP,
+    FIELD_INCLUDE,
+    FIELD_EXCLUDE,
+    CAPTURE_FILE,
+    CAPTURE_MAX_BYTES,
+    CAPTURE_BACKUP_COUNT)
 
 
 COMMANDLINE_PARAMETERS = {
@@ -368,5 +381,212 @@ class TestGeneralSectionConfigFileParser(unittest.TestCase):
         os.remove(self._config_file)
 
 
+class TestSpecificSectionConfigFileParser(unittest.TestCase):
+    """
+    Checks the options accepted only in the application specific section of
+    the configuration file and on the command line.
+    """
+
+    def setUp(self):
+        self._default = Mock()
+        self._default.influxdb_targets = INFLUXDB_TARGETS
+        self._default.influxdb_replicas = INFLUXDB_REPLICAS
+        self._default.concurrent_dispatch = CONCURRENT_DISPATCH
+        self._default.mqtt_tick = MQTT_TICK
+        self._default.mqtt_collapse = False
+        self._default.mqtt_inflight = MQTT_INFLIGHT
+        self._default.memory_budget = MEMORY_BUDGET
+        self._default.memory_trace = False
+        self._default.memory_top = MEMORY_TOP
+        self._default.debug_routes = False
+        self._default.field_include = FIELD_INCLUDE
+        self._default.field_exclude = FIELD_EXCLUDE
+        self._default.capture_file = CAPTURE_FILE
+        self._default.capture_max_bytes = CAPTURE_MAX_BYTES
+        self._default.capture_backup_count = CAPTURE_BACKUP_COUNT
+
+        self._test = Mock()
+        self._test.influxdb_targets = 'influxdb-1:8086,influxdb-2:8086'
+        self._test.influxdb_replicas = INFLUXDB_REPLICAS + 1
+        self._test.concurrent_dispatch = not CONCURRENT_DISPATCH
+        self._test.mqtt_tick = MQTT_TICK + 0.5
+        self._test.mqtt_collapse = True
+        self._test.mqtt_inflight = MQTT_INFLIGHT + 1
+        self._test.memory_budget = MEMORY_BUDGET + 64
+        self._test.memory_trace = True
+        self._test.memory_top = MEMORY_TOP + 1
+        self._test.debug_routes = True
+        self._test.field_include = 'SDS_*,DHT22_*'
+        self._test.field_exclude = 'signal,feinstaub/samples'
+        self._test.capture_file = '/tmp/capture_test.gz'
+        self._test.capture_max_bytes = CAPTURE_MAX_BYTES + 100
+        self._test.capture_backup_count = CAPTURE_BACKUP_COUNT + 1
+
+        self._option = Mock()
+        self._option.influxdb_targets = 'influxdb-3:8086'
+        self._option.influxdb_replicas = INFLUXDB_REPLICAS + 2
+        self._option.concurrent_dispatch = CONCURRENT_DISPATCH
+        self._option.mqtt_tick = MQTT_TICK + 1.5
+        self._option.mqtt_collapse = False
+        self._option.mqtt_inflight = MQTT_INFLIGHT + 2
+        self._option.memory_budget = MEMORY_BUDGET + 128
+        self._option.memory_trace = False
+        self._option.memory_top = MEMORY_TOP + 2
+        self._option.debug_routes = False
+        self._option.field_include = 'BME280_*'
+        self._option.field_exclude = 'SDS_P2'
+        self._option.capture_file = '/tmp/capture_option.gz'
+        self._option.capture_max_bytes = CAPTURE_MAX_BYTES + 200
+        self._option.capture_backup_count = CAPTURE_BACKUP_COUNT + 2
+
+        self._config_file = '/tmp/config.ini'
+        _f = open(self._config_file, "w")
+        _f.write("[GENERAL]\n")
+        _f.write("capture_file = {}\n".format('/tmp/capture_general.gz'))
+        _f.write("[{:s}]\n".format(APPLICATION_NAME))
+        _f.write("influxdb_targets = {}\n".format(
+            self._test.influxdb_targets))
+        _f.write("influxdb_replicas = {}\n".format(
+            self._test.influxdb_replicas))
+        _f.write("concurrent_dispatch = {}\n".format(
+            'yes' if self._test.concurrent_dispatch else 'no'))
+        _f.write("mqtt_tick = {}\n".format(self._test.mqtt_tick))
+        _f.write("mqtt_collapse = {}\n".format(
+            'yes' if self._test.mqtt_collapse else 'no'))
+        _f.write("mqtt_inflight = {}\n".format(self._test.mqtt_inflight))
+        _f.write("memory_budget = {}\n".format(self._test.memory_budget))
+        _f.write("memory_trace = {}\n".format(self._test.memory_trace))
+        _f.write("memory_top = {}\n".format(self._test.memory_top))
+        _f.write("debug_routes = {}\n".format(self._test.debug_routes))
+        _f.write("field_include = {}\n".format(self._test.field_include))
+        _f.write("field_exclude = {}\n".format(self._test.field_exclude))
+        _f.write("capture_file = {}\n".format(self._test.capture_file))
+        _f.write("capture_max_bytes = {}\n".format(
+            self._test.capture_max_bytes))
+        _f.write("capture_backup_count = {}\n".format(
+            self._test.capture_backup_count))
+        _f.close()
+
+    def test_specific_default(self):
+        """
+        Checks the defaults of the specific options.
+        """
+        _args = configuration_parser([])
+
+        self.assertEqual(
+            self._default.influxdb_targets, _args.influxdb_targets)
+        self.assertEqual(
+            self._default.influxdb_replicas, _args.influxdb_replicas)
+        self.assertEqual(
+            self._default.concurrent_dispatch, _args.concurrent_dispatch)
+        self.assertEqual(self._default.mqtt_tick, _args.mqtt_tick)
+        self.assertEqual(self._default.mqtt_collapse, _args.mqtt_collapse)
+        self.assertEqual(self._default.mqtt_inflight, _args.mqtt_inflight)
+        self.assertEqual(self._default.memory_budget, _args.memory_budget)
+        self.assertEqual(self._default.memory_trace, _args.memory_trace)
+        self.assertEqual(self._default.memory_top, _args.memory_top)
+        self.assertEqual(self._default.debug_routes, _args.debug_routes)
+        self.assertEqual(self._default.field_include, _args.field_include)
+        self.assertEqual(self._default.field_exclude, _args.field_exclude)
+        self.assertEqual(self._default.capture_file, _args.capture_file)
+        self.assertEqual(
+            self._default.capture_max_bytes, _args.capture_max_bytes)
+        self.assertEqual(
+            self._default.capture_backup_count, _args.capture_backup_count)
+
+    def test_specific_options(self):
+        """
+        Tests the parsing of the specific options in the configuration file.
+        """
+        _args = configuration_parser(['-c', self._config_file])
+
+        self.assertEqual(self._test.influxdb_targets, _args.influxdb_targets)
+        self.assertEqual(
+            self._test.influxdb_replicas, _args.influxdb_replicas)
+        self.assertEqual(
+            self._test.concurrent_dispatch, _args.concurrent_dispatch)
+        self.assertEqual(self._test.mqtt_tick, _args.mqtt_tick)
+        self.assertEqual(self._test.mqtt_collapse, _args.mqtt_collapse)
+        self.assertEqual(self._test.mqtt_inflight, _args.mqtt_inflight)
+        self.assertEqual(self._test.memory_budget, _args.memory_budget)
+        self.assertEqual(self._test.memory_trace, _args.memory_trace)
+        self.assertEqual(self._test.memory_top, _args.memory_top)
+        self.assertEqual(self._test.debug_routes, _args.debug_routes)
+        self.assertEqual(self._test.field_include, _args.field_include)
+        self.assertEqual(self._test.field_exclude, _args.field_exclude)
+        self.assertEqual(self._test.capture_file, _args.capture_file)
+        self.assertEqual(self._test.capture_max_bytes, _args.capture_max_bytes)
+        self.assertEqual(
+            self._test.capture_backup_count, _args.capture_backup_count)
+
+    def test_specific_command_line_override(self):
+        """
+        Tests if the command line options override the specific options in the
+        configuration file.
+        """
+        _cmd_line = ['-c', self._config_file]
+        _cmd_line.extend(
+            ['--influxdb-targets', self._option.influxdb_targets])
+        _cmd_line.extend(
+            ['--influxdb-replicas', str(self._option.influxdb_replicas)])
+        _cmd_line.extend(
+            ['--concurrent-dispatch', str(self._option.concurrent_dispatch)])
+        _cmd_line.extend(['--mqtt-tick', str(self._option.mqtt_tick)])
+        _cmd_line.extend(
+            ['--mqtt-collapse', str(self._option.mqtt_collapse)])
+        _cmd_line.extend(
+            ['--mqtt-inflight', str(self._option.mqtt_inflight)])
+        _cmd_line.extend(
+            ['--memory-budget', str(self._option.memory_budget)])
+        _cmd_line.extend(['--memory-trace', str(self._option.memory_trace)])
+        _cmd_line.extend(['--memory-top', str(self._option.memory_top)])
+        _cmd_line.extend(['--debug-routes', str(self._option.debug_routes)])
+        _cmd_line.extend(['--field-include', self._option.field_include])
+        _cmd_line.extend(['--field-exclude', self._option.field_exclude])
+        _cmd_line.extend(['--capture-file', self._option.capture_file])
+        _cmd_line.extend(
+            ['--capture-max-bytes', str(self._option.capture_max_bytes)])
+        _cmd_line.extend(
+            ['--capture-backup-count', str(self._option.capture_backup_count)])
+
+        _args = configuration_parser(_cmd_line)
+
+        self.assertEqual(
+            self._option.influxdb_targets, _args.influxdb_targets)
+        self.assertEqual(
+            self._option.influxdb_replicas, _args.influxdb_replicas)
+        self.assertEqual(
+            self._option.concurrent_dispatch, _args.concurrent_dispatch)
+        self.assertEqual(self._option.mqtt_tick, _args.mqtt_tick)
+        self.assertEqual(self._option.mqtt_collapse, _args.mqtt_collapse)
+        self.assertEqual(self._option.mqtt_inflight, _args.mqtt_inflight)
+        self.assertEqual(self._option.memory_budget, _args.memory_budget)
+        self.assertEqual(self._option.memory_trace, _args.memory_trace)
+        self.assertEqual(self._option.memory_top, _args.memory_top)
+        self.assertEqual(self._option.debug_routes, _args.debug_routes)
+        self.assertEqual(self._option.field_include, _args.field_include)
+        self.assertEqual(self._option.field_exclude, _args.field_exclude)
+        self.assertEqual(self._option.capture_file, _args.capture_file)
+        self.assertEqual(
+            self._option.capture_max_bytes, _args.capture_max_bytes)
+        self.assertEqual(
+            self._option.capture_backup_count, _args.capture_backup_count)
+
+    def test_specific_flag(self):
+        """
+        Tests that the boolean options can be given without a value.
+        """
+        _args = configuration_parser(['--mqtt-collapse'])
+
+        self.assertTrue(_args.mqtt_collapse)
+
+        _args = configuration_parser(['--concurrent-dispatch', 'no'])
+
+        self.assertFalse(_args.concurrent_dispatch)
+
+    def tearDown(self):
+        os.remove(self._config_file)
+
+
 if __name__ == '__main__':
     unittest.main()
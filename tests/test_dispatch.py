@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests the /write route with the MQTT messages published on a
+dispatch thread while the data is written to InfluxDB.
+"""
+
+import logging
+import unittest
+import threading
+
+from unittest.mock import patch
+from influxdb.exceptions import InfluxDBClientError
+from feinstaub_publisher import app, INFLUXDBRequest, DispatchThreads
+from feinstaub_publisher import InfluxDBTarget, InfluxDBRouter
+
+
+class TestConcurrentDispatch(unittest.TestCase):
+    """
+    Tests the concurrent InfluxDB write and MQTT publication.
+    """
+
+    def setUp(self):
+        _patcher = patch('feinstaub_publisher.influxdb.InfluxDBClient')
+        self._client = _patcher.start().return_value
+        self.addCleanup(_patcher.stop)
+
+        self._client.request.return_value.json.return_value = {
+            'results': [{'series': [{'values': [['luftdaten']]}]}]}
+        self._client.request.return_value.text = ''
+        self._client.request.return_value.status_code = 204
+
+        _patcher = patch('feinstaub_publisher.publish.multiple')
+        self._publish = _patcher.start()
+        self.addCleanup(_patcher.stop)
+
+        self._executor = DispatchThreads()
+
+        app.config.from_mapping({
+            'LOGGER': logging.getLogger('test'),
+            'INFLUXDB_DB': 'luftdaten',
+            'INFLUXDB_ROUTER': InfluxDBRouter(
+                [InfluxDBTarget('localhost', 8086)]),
+            'MQTT_LOCAL_HOST': 'localhost',
+            'MQTT_LOCAL_PORT': 1883,
+            'MQTT_TOPIC': 'sensor/FEINSTAUB',
+            'LATITUDE': 0.0,
+            'LONGITUDE': 0.0,
+            'EXECUTOR': self._executor,
+        })
+        app.request_class = INFLUXDBRequest
+        self._test_client = app.test_client()
+
+    def _post(self):
+        return self._test_client.post(
+            '/write?db=luftdaten',
+            data=b'feinstaub,node=esp8266-1 SDS_P1=12.5,SDS_P2=7.2',
+            content_type='application/x-www-form-urlencoded')
+
+    def test_influxdb_failure(self):
+        """
+        Tests that the response carries the InfluxDB error while the MQTT
+        messages are still published.
+        """
+        # The database check succeeds, the write fails
+        self._client.request.side_effect = [
+            self._client.request.return_value,
+            InfluxDBClientError('partial write', 400)]
+
+        _response = self._post()
+
+        self.assertEqual(400, _response.status_code)
+        self.assertEqual(b'partial write', _response.data)
+        self._publish.assert_called_once()
+        self.assertEqual(
+            'WeatherObserved/esp8266-1.SDS',
+            self._publish.call_args[0][0][0]['topic'])
+
+    def test_mqtt_failure(self):
+        """
+        Tests that an exception of the MQTT publication reaches the caller.
+        """
+        self._publish.side_effect = RuntimeError('broker failure')
+        app.config['PROPAGATE_EXCEPTIONS'] = True
+
+        with self.assertRaises(RuntimeError):
+            self._post()
+
+        self.assertEqual(2, self._client.request.call_count)
+        self.assertEqual('write', self._client.request.call_args[0][0])
+
+    def test_threads(self):
+        """
+        Tests that the calls run at the same time, none waiting for a free
+        thread.
+        """
+        _barrier = threading.Barrier(16, timeout=5)
+        _futures = [self._executor.submit(_barrier.wait) for _i in range(16)]
+
+        self.assertEqual(
+            set(range(16)), {_f.result() for _f in _futures})
+
+    def tearDown(self):
+        app.config['PROPAGATE_EXCEPTIONS'] = None
+        app.config['EXECUTOR'] = None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * the include and exclude rules of the field projection;
+    * that the dropped fields reach neither InfluxDB nor the MQTT broker.
+"""
+
+import json
+import logging
+import unittest
+
+from unittest.mock import patch
+from feinstaub_publisher import app, parse_points, INFLUXDBRequest
+from feinstaub_publisher import FieldProjection, InfluxDBTarget, InfluxDBRouter
+
+
+SFDS_POINT = ('feinstaub,node=esp8266-1 SDS_P1=12.5,SDS_P2=7.2,'
+              'temperature=21.0,humidity=48.0,BME280_pressure=101325.0,'
+              'samples=874,min_micro=188,max_micro=21412,signal=-71')
+
+
+class TestFieldProjection(unittest.TestCase):
+    """
+    Tests the field projection rules.
+    """
+
+    def test_exclude(self):
+        """
+        Tests the exclude rules by field name and by sensor model prefix.
+        """
+        _projection = FieldProjection(exclude=[
+            'signal', 'samples', 'min_micro', 'max_micro', 'BME280_*'])
+
+        self.assertEqual(
+            'feinstaub,node=esp8266-1 SDS_P1=12.5,SDS_P2=7.2,'
+            'temperature=21.0,humidity=48.0',
+            _projection.apply(SFDS_POINT.encode())[0])
+        self.assertEqual(4, _projection.kept)
+        self.assertEqual(5, _projection.dropped)
+
+    def test_include(self):
+        """
+        Tests that only the included fields are kept, less the excluded ones,
+        and that the DHT22 fields match their model prefix.
+        """
+        _projection = FieldProjection(
+            include=['SDS_*', 'DHT22_*'], exclude=['SDS_P2'])
+
+        self.assertEqual(
+            'feinstaub,node=esp8266-1 SDS_P1=12.5,temperature=21.0,'
+            'humidity=48.0',
+            _projection.apply(SFDS_POINT)[0])
+
+    def test_measurement(self):
+        """
+        Tests the rules restricted to a measurement and the removal of the
+        points left without fields.
+        """
+        _projection = FieldProjection(exclude=['other/*', 'feinstaub/signal'])
+
+        _data, _points = _projection.apply(
+            'feinstaub,node=esp8266-1 SDS_P1=1.0,signal=-71 1500000000\n'
+            'other,node=esp8266-1 signal=-71')
+
+        self.assertEqual(
+            'feinstaub,node=esp8266-1 SDS_P1=1.0 1500000000', _data)
+        self.assertEqual(parse_points(_data), _points)
+
+
+class TestWriteProjection(unittest.TestCase):
+    """
+    Tests the /write route with a field projection.
+    """
+
+    def setUp(self):
+        _patcher = patch('feinstaub_publisher.influxdb.InfluxDBClient')
+        self._client = _patcher.start().return_value
+        self.addCleanup(_patcher.stop)
+
+        self._client.request.return_value.json.return_value = {
+            'results': [{'series': [{'values': [['luftdaten']]}]}]}
+        self._client.request.return_value.text = ''
+        self._client.request.return_value.status_code = 204
+
+        _patcher = patch('feinstaub_publisher.publish.multiple')
+        self._publish = _patcher.start()
+        self.addCleanup(_patcher.stop)
+
+        app.config.from_mapping({
+            'LOGGER': logging.getLogger('test'),
+            'INFLUXDB_DB': 'luftdaten',
+            'INFLUXDB_ROUTER': InfluxDBRouter(
+                [InfluxDBTarget('localhost', 8086)]),
+            'MQTT_LOCAL_HOST': 'localhost',
+            'MQTT_LOCAL_PORT': 1883,
+            'MQTT_TOPIC': 'sensor/FEINSTAUB',
+            'LATITUDE': 0.0,
+            'LONGITUDE': 0.0,
+            'EXECUTOR': None,
+            'FIELD_PROJECTION': FieldProjection(exclude=['SDS_P2', 'signal']),
+            'DEBUG_ROUTES': True,
+        })
+        app.request_class = INFLUXDBRequest
+        self._test_client = app.test_client()
+
+    def _post(self, p_data):
+        return self._test_client.post(
+            '/write?db=luftdaten', data=p_data,
+            content_type='application/x-www-form-urlencoded')
+
+    def test_write(self):
+        """
+        Tests that the dropped fields are neither written nor published and
+        that the counters are reported.
+        """
+        with patch('feinstaub_publisher.parse_points') as _parse_points:
+            _response = self._post(
+                b'feinstaub,node=esp8266-1 SDS_P1=12.5,SDS_P2=7.2,signal=-71')
+        self.assertEqual(204, _response.status_code)
+
+        # The MQTT messages use the points split by the projection
+        _parse_points.assert_not_called()
+
+        self.assertEqual(
+            'feinstaub,node=esp8266-1 SDS_P1=12.5',
+            self._client.request.call_args[1]['data'])
+
+        _messages = self._publish.call_args[0][0]
+        self.assertEqual(1, len(_messages))
+        self.assertNotIn('PM2.5', json.loads(_messages[0]['payload']))
+
+        _counters = self._test_client.get('/debug/fields').get_json()
+        self.assertEqual({'kept': 1, 'dropped': 2}, _counters)
+
+    def test_all_dropped(self):
+        """
+        Tests that nothing is written when all the fields are dropped.
+        """
+        _response = self._post(b'feinstaub,node=esp8266-1 signal=-71')
+
+        self.assertEqual(204, _response.status_code)
+        self._client.request.assert_not_called()
+        self._publish.assert_not_called()
+
+    def test_fields_disabled(self):
+        """
+        Tests that the counters are not served without the debug routes.
+        """
+        app.config['DEBUG_ROUTES'] = False
+
+        _response = self._test_client.get('/debug/fields')
+        self.assertEqual(404, _response.status_code)
+
+    def tearDown(self):
+        app.config['FIELD_PROJECTION'] = None
+        app.config['DEBUG_ROUTES'] = False
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * the consistent hashing of the stations to the InfluxDB targets;
+    * the grouping of the points in one batch for each target;
+    * the writes of the /write route to several targets.
+"""
+
+import base64
+import logging
+import unittest
+
+from unittest.mock import patch, MagicMock
+from influxdb.exceptions import InfluxDBClientError
+from feinstaub_publisher import app, INFLUXDBRequest
+from feinstaub_publisher import InfluxDBTarget, InfluxDBRouter, DispatchThreads
+
+
+def _targets(p_count):
+    return [InfluxDBTarget('influxdb-{:d}'.format(_i), 8086)
+            for _i in range(p_count)]
+
+
+class TestInfluxDBRouter(unittest.TestCase):
+    """
+    Tests the routing of the stations.
+    """
+
+    def test_single_target(self):
+        """
+        Tests that the body is passed unchanged with a single target.
+        """
+        _router = InfluxDBRouter(_targets(1), replicas=3)
+        _data = b'feinstaub,node=esp8266-1 SDS_P1=1.0'
+
+        self.assertEqual(1, _router.replicas)
+        self.assertEqual([(_router.targets[0], _data)], _router.batches(_data))
+
+    def test_route(self):
+        """
+        Tests that the routes are stable, use distinct targets and spread the
+        stations across all the targets.
+        """
+        _targets_list = _targets(3)
+        _router = InfluxDBRouter(_targets_list, replicas=2)
+        _other = InfluxDBRouter(_targets_list, replicas=2)
+
+        _used = set()
+        for _i in range(100):
+            _station = 'esp8266-{:d}'.format(_i)
+            _route = _router.route(_station)
+
+            self.assertEqual(2, len(set(_route)))
+            self.assertEqual(_route, _other.route(_station))
+            _used.add(_route[0])
+
+        self.assertEqual(set(_targets_list), _used)
+
+    def test_add_target(self):
+        """
+        Tests that adding a target moves the stations only to the new one.
+        """
+        _targets_list = _targets(4)
+        _router = InfluxDBRouter(_targets_list[:3])
+        _grown = InfluxDBRouter(_targets_list)
+
+        for _i in range(100):
+            _station = 'esp8266-{:d}'.format(_i)
+            _before = _router.route(_station)[0]
+            _after = _grown.route(_station)[0]
+            if _before is not _after:
+                self.assertIs(_targets_list[3], _after)
+
+    def test_batches(self):
+        """
+        Tests that the points are grouped by target.
+        """
+        _router = InfluxDBRouter(_targets(3))
+        _points = ['feinstaub,node=esp8266-{:d} SDS_P1=1.0'.format(_i)
+                   for _i in range(20)]
+
+        _batches = _router.batches('\n'.join(_points).encode())
+
+        _written = []
+        for _target, _batch in _batches:
+            for _point in _batch.splitlines():
+                _station = _point.split(' ')[0].split('=')[1]
+                self.assertIs(_target, _router.route(_station)[0])
+                _written.append(_point)
+
+        self.assertEqual(sorted(_points), sorted(_written))
+
+    def test_max_routes(self):
+        """
+        Tests that the cache of the routes is bounded.
+        """
+        _router = InfluxDBRouter(_targets(3), max_routes=10)
+        for _i in range(100):
+            _station = 'esp8266-{:d}'.format(_i)
+            self.assertEqual(
+                _router.route(_station), _router.route(_station))
+
+        self.assertEqual(10, len(_router._routes))
+
+
+class TestWriteTargets(unittest.TestCase):
+    """
+    Tests the /write route with a replicated station.
+    """
+
+    def setUp(self):
+        _patcher = patch('feinstaub_publisher.influxdb.InfluxDBClient')
+        self._client_class = _patcher.start()
+        self._client_class.side_effect = self._new_client
+        self.addCleanup(_patcher.stop)
+        self._clients = {}
+
+        _publisher = patch('feinstaub_publisher.publish.multiple')
+        _publisher.start()
+        self.addCleanup(_publisher.stop)
+
+        self._router = InfluxDBRouter(_targets(2), replicas=2)
+        app.config.from_mapping({
+            'LOGGER': logging.getLogger('test'),
+            'INFLUXDB_DB': 'luftdaten',
+            'INFLUXDB_ROUTER': self._router,
+            'MQTT_LOCAL_HOST': 'localhost',
+            'MQTT_LOCAL_PORT': 1883,
+            'MQTT_TOPIC': 'sensor/FEINSTAUB',
+            'LATITUDE': 0.0,
+            'LONGITUDE': 0.0,
+            'EXECUTOR': None,
+        })
+        app.request_class = INFLUXDBRequest
+        self._test_client = app.test_client()
+
+    def _new_client(self, **kwargs):
+        _client = MagicMock()
+        _client.request.return_value.json.return_value = {
+            'results': [{'series': [{'values': [['luftdaten']]}]}]}
+        _client.request.return_value.text = ''
+        _client.request.return_value.status_code = 204
+        self._clients[kwargs['host']] = _client
+        return _client
+
+    def _post(self, p_headers=None):
+        return self._test_client.post(
+            '/write?db=luftdaten',
+            data=b'feinstaub,node=esp8266-1 SDS_P1=1.0',
+            headers=p_headers,
+            content_type='application/x-www-form-urlencoded')
+
+    @staticmethod
+    def _calls(p_client, p_url):
+        return [_c for _c in p_client.request.call_args_list
+                if _c[0][0] == p_url]
+
+    def test_replicated_write(self):
+        """
+        Tests that the point is written to both targets, on one keep-alive
+        client each, and that the database is checked only once.
+        """
+        for _i in range(2):
+            self.assertEqual(204, self._post().status_code)
+
+        self.assertEqual(['influxdb-0', 'influxdb-1'], sorted(self._clients))
+        for _client in self._clients.values():
+            self.assertEqual(1, len(self._calls(_client, 'query')))
+            self.assertEqual(2, len(self._calls(_client, 'write')))
+
+    def test_credentials(self):
+        """
+        Tests that the credentials of each request are sent with its write
+        without creating a client for them.
+        """
+        for _i in range(200):
+            _credentials = base64.b64encode(
+                'user:wrong-{:d}'.format(_i).encode()).decode()
+            self._post({'Authorization': 'Basic ' + _credentials})
+
+        self.assertEqual(2, self._client_class.call_count)
+        for _client in self._clients.values():
+            _headers = self._calls(_client, 'write')[-1][1]['headers']
+            self.assertEqual(
+                'Basic ' + _credentials, _headers['Authorization'])
+
+    def test_database_dropped(self):
+        """
+        Tests that the database is checked again after a write reports it as
+        missing.
+        """
+        self.assertEqual(204, self._post().status_code)
+
+        for _client in self._clients.values():
+            _client.request.side_effect = [
+                InfluxDBClientError('database not found: "luftdaten"', 404),
+                _client.request.return_value,
+                _client.request.return_value]
+        self.assertEqual(404, self._post().status_code)
+        self.assertEqual(204, self._post().status_code)
+
+        for _client in self._clients.values():
+            self.assertEqual(2, len(self._calls(_client, 'query')))
+
+    def test_parallel_failure(self):
+        """
+        Tests that the batches are written on the dispatch threads and that the
+        response carries the failure of either target.
+        """
+        app.config['EXECUTOR'] = DispatchThreads()
+        self.addCleanup(app.config.update, {'EXECUTOR': None})
+
+        self.assertEqual(204, self._post().status_code)
+
+        for _failing in ['influxdb-0', 'influxdb-1']:
+            for _host, _client in self._clients.items():
+                _client.request.reset_mock()
+                _client.request.side_effect = (
+                    InfluxDBClientError('field type conflict', 400)
+                    if _host == _failing else None)
+
+            _response = self._post()
+
+            self.assertEqual(400, _response.status_code)
+            self.assertEqual(b'field type conflict', _response.data)
+            for _client in self._clients.values():
+                self.assertEqual(1, len(self._calls(_client, 'write')))
+
+
+class TestAnonymousWrite(unittest.TestCase):
+    """
+    Tests the /write route without credentials on a real InfluxDB client.
+    """
+
+    def setUp(self):
+        _patcher = patch('requests.Session.request')
+        self._request = _patcher.start()
+        self._request.side_effect = self._response
+        self.addCleanup(_patcher.stop)
+
+        _publisher = patch('feinstaub_publisher.publish.multiple')
+        _publisher.start()
+        self.addCleanup(_publisher.stop)
+
+        app.config.from_mapping({
+            'LOGGER': logging.getLogger('test'),
+            'INFLUXDB_DB': 'luftdaten',
+            'INFLUXDB_ROUTER': InfluxDBRouter(_targets(1)),
+            'MQTT_LOCAL_HOST': 'localhost',
+            'MQTT_LOCAL_PORT': 1883,
+            'MQTT_TOPIC': 'sensor/FEINSTAUB',
+            'LATITUDE': 0.0,
+            'LONGITUDE': 0.0,
+            'EXECUTOR': None,
+        })
+        app.request_class = INFLUXDBRequest
+        self._test_client = app.test_client()
+
+    @staticmethod
+    def _response(method, url, **kwargs):
+        _response = MagicMock()
+        if url.endswith('/write'):
+            _response.status_code = 204
+        else:
+            _response.status_code = 200
+            _response.json.return_value = {
+                'results': [{'series': [{'values': [['luftdaten']]}]}]}
+        return _response
+
+    def test_anonymous(self):
+        """
+        Tests that the database check and the write of a request without
+        credentials are sent without credentials.
+        """
+        _response = self._test_client.post(
+            '/write?db=luftdaten',
+            data=b'feinstaub,node=esp8266-1 SDS_P1=1.0',
+            content_type='application/x-www-form-urlencoded')
+        self.assertEqual(204, _response.status_code)
+
+        self.assertEqual(2, self._request.call_count)
+        for _call in self._request.call_args_list:
+            self.assertIsNone(_call[1]['auth'])
+            self.assertNotIn('Authorization', _call[1]['headers'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests:
+    * the sizing of the buffers from the memory budget;
+    * that the requests are refused while the accounted memory or the
+    measured growth exceeds the memory budget, and accepted again once enough
+    memory is released;
+    * the memory report endpoint.
+"""
+
+import logging
+import unittest
+import tracemalloc
+
+from unittest.mock import patch
+from feinstaub_publisher import app, MemoryBudget
+
+
+class TestMemoryBudget(unittest.TestCase):
+    """
+    Tests the memory budget and the memory report.
+    """
+
+    def setUp(self):
+        # The measured memory is set by the tests
+        self._memory = 0
+        _patcher = patch.object(
+            MemoryBudget, '_measure', staticmethod(lambda: self._memory))
+        _patcher.start()
+        self.addCleanup(_patcher.stop)
+        _patcher = patch.object(MemoryBudget, 'SAMPLE_INTERVAL', 0)
+        _patcher.start()
+        self.addCleanup(_patcher.stop)
+
+        app.config.from_mapping({
+            'LOGGER': logging.getLogger('test'),
+            'MEMORY_BUDGET': MemoryBudget(1000),
+            'MEMORY_TOP': 3,
+            'DEBUG_ROUTES': True,
+        })
+        self._client = app.test_client()
+
+    def test_items(self):
+        """
+        Tests that the number of items is bounded by the budget and the
+        maximum.
+        """
+        _budget = MemoryBudget(1000)
+
+        self.assertEqual(10, _budget.items(0.1, 10, 100))
+        self.assertEqual(5, _budget.items(0.1, 10, 5))
+        self.assertEqual(1, _budget.items(0.1, 1000, 5))
+
+    def test_hysteresis(self):
+        """
+        Tests that requests are refused above the shed ratio of the budget
+        until the accounted memory falls below the resume ratio.
+        """
+        _held = [0]
+        _budget = MemoryBudget(1000)
+        _budget.account(lambda: _held[0])
+
+        self.assertTrue(_budget.enter())
+        _budget.leave()
+
+        _held[0] = 950
+        self.assertFalse(_budget.enter())
+
+        # Still above the resume ratio
+        _held[0] = 800
+        self.assertFalse(_budget.enter())
+
+        _held[0] = 0
+        self.assertTrue(_budget.enter())
+        self.assertEqual(MemoryBudget.REQUEST_SIZE, _budget.used())
+        _budget.leave()
+
+        self.assertEqual(0, _budget.used())
+        self.assertEqual(2, _budget.shed)
+
+    def test_growth(self):
+        """
+        Tests that requests are refused while the measured growth of the
+        memory is above the shed ratio of the budget.
+        """
+        # Room for the request being served
+        _budget = MemoryBudget(10 * MemoryBudget.REQUEST_SIZE)
+        self.assertTrue(_budget.enter())
+
+        self._memory = int(_budget.budget * 0.95)
+        self.assertFalse(_budget.enter())
+        self.assertEqual(self._memory, _budget.used())
+
+        # Still above the resume ratio
+        self._memory = int(_budget.budget * 0.8)
+        self.assertFalse(_budget.enter())
+
+        self._memory = int(_budget.budget * 0.6)
+        self.assertTrue(_budget.enter())
+        self.assertEqual(0, _budget.rebased)
+
+    def test_rebase(self):
+        """
+        Tests that the baseline is moved up when the measured growth is over
+        the budget with no request being served.
+        """
+        _budget = MemoryBudget(1000)
+        self._memory = 950
+
+        self.assertTrue(_budget.enter())
+        self.assertEqual(1, _budget.rebased)
+        self.assertEqual(950, _budget.baseline)
+        self.assertEqual(0, _budget.growth())
+
+        self._memory = 1900
+        self.assertFalse(_budget.enter())
+
+    def test_shed(self):
+        """
+        Tests that /write is refused while the budget is exceeded while the
+        other routes are served.
+        """
+        app.config['MEMORY_BUDGET'].account(lambda: 950)
+
+        _response = self._client.post('/write?db=luftdaten', data=b'')
+        self.assertEqual(503, _response.status_code)
+        self.assertEqual('1', _response.headers['Retry-After'])
+
+        _response = self._client.get('/debug/memory')
+        self.assertEqual(200, _response.status_code)
+
+        self.assertEqual(1, app.config['MEMORY_BUDGET'].shed)
+        self.assertEqual(950, app.config['MEMORY_BUDGET'].used())
+
+    def test_report_disabled(self):
+        """
+        Tests that the memory report is not served unless enabled.
+        """
+        app.config['DEBUG_ROUTES'] = False
+
+        self.assertEqual(404, self._client.get('/debug/memory').status_code)
+
+    def test_report(self):
+        """
+        Tests the memory report with and without tracemalloc.
+        """
+        _report = self._client.get('/debug/memory').get_json()
+        self.assertEqual(1000, _report['budget'])
+        self.assertEqual(0, _report['used'])
+        self.assertGreater(_report['resident'], 0)
+        self.assertIsNone(_report['top'])
+
+        tracemalloc.start()
+        try:
+            _report = self._client.get('/debug/memory?top=2').get_json()
+        finally:
+            tracemalloc.stop()
+
+        self.assertIsNotNone(_report['traced'])
+        self.assertLessEqual(len(_report['top']), 2)
+
+    def tearDown(self):
+        app.config['MEMORY_BUDGET'] = None
+        app.config['DEBUG_ROUTES'] = False
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+#  Copyright 2018, CRS4 - Center for Advanced Studies, Research and Development
+#  in Sardinia
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+This module tests that the MQTT output stage publishes the messages of all
+the requests together and collapses the messages of the same topic.
+"""
+
+import unittest
+
+from unittest.mock import Mock, patch
+from paho.mqtt.client import MQTT_ERR_QUEUE_SIZE
+from feinstaub_publisher import MQTTOutputStage
+
+
+def _messages(p_station, p_value):
+    return [
+        {'topic': 'WeatherObserved/{}.SDS'.format(p_station),
+         'payload': '{{"PM10": {}}}'.format(p_value),
+         'qos': 0, 'retain': False},
+        {'topic': 'WeatherObserved/{}.DHT22'.format(p_station),
+         'payload': '{{"temperature": {}}}'.format(p_value),
+         'qos': 0, 'retain': False}]
+
+
+class TestMQTTOutputStage(unittest.TestCase):
+    """
+    Tests the MQTT output stage with a mocked MQTT client.
+    """
+
+    def setUp(self):
+        _patcher = patch('feinstaub_publisher.mqtt.Client')
+        self._client = _patcher.start().return_value
+        self._client.publish.return_value.rc = 0
+        self.addCleanup(_patcher.stop)
+
+    def _published(self):
+        return [(_c[0][0], _c[0][1], _c[1]['qos'])
+                for _c in self._client.publish.call_args_list]
+
+    def test_coalesce(self):
+        """
+        Tests that the messages are published only on flush, with QoS 1, and
+        that the in-flight window is set.
+        """
+        _stage = MQTTOutputStage('localhost', 1883, 3600, inflight=5)
+        _stage.put(_messages('esp8266-1', 1))
+        _stage.put(_messages('esp8266-2', 2))
+
+        self._client.publish.assert_not_called()
+        self._client.max_inflight_messages_set.assert_called_once_with(5)
+
+        _stage.close()
+
+        self.assertEqual([
+            ('WeatherObserved/esp8266-1.SDS', '{"PM10": 1}', 1),
+            ('WeatherObserved/esp8266-1.DHT22', '{"temperature": 1}', 1),
+            ('WeatherObserved/esp8266-2.SDS', '{"PM10": 2}', 1),
+            ('WeatherObserved/esp8266-2.DHT22', '{"temperature": 2}', 1)],
+            self._published())
+        self.assertEqual(4, _stage.published)
+
+    def test_collapse(self):
+        """
+        Tests that only the latest message of each topic is published.
+        """
+        _stage = MQTTOutputStage('localhost', 1883, 3600, collapse=True)
+        _stage.put(_messages('esp8266-1', 1))
+        _stage.put(_messages('esp8266-2', 2))
+        _stage.put(_messages('esp8266-1', 3))
+        _stage.close()
+
+        self.assertEqual([
+            ('WeatherObserved/esp8266-2.SDS', '{"PM10": 2}', 1),
+            ('WeatherObserved/esp8266-2.DHT22', '{"temperature": 2}', 1),
+            ('WeatherObserved/esp8266-1.SDS', '{"PM10": 3}', 1),
+            ('WeatherObserved/esp8266-1.DHT22', '{"temperature": 3}', 1)],
+            self._published())
+        self.assertEqual(2, _stage.collapsed)
+
+    def test_queue_full(self):
+        """
+        Tests that the messages refused by the client are counted as dropped.
+        """
+        self._client.publish.side_effect = [
+            Mock(rc=0), Mock(rc=MQTT_ERR_QUEUE_SIZE)]
+
+        _stage = MQTTOutputStage('localhost', 1883, 3600)
+        _stage.put(_messages('esp8266-1', 1))
+        _stage.close()
+
+        self.assertEqual(1, _stage.published)
+        self.assertEqual(1, _stage.dropped)
+
+    def test_max_pending(self):
+        """
+        Tests that the messages waiting for the tick are bounded.
+        """
+        _stage = MQTTOutputStage('localhost', 1883, 3600, max_queued=3)
+        _stage.put(_messages('esp8266-1', 1))
+        _stage.put(_messages('esp8266-2', 2))
+        _stage.close()
+
+        self.assertEqual(3, _stage.published)
+        self.assertEqual(1, _stage.dropped)
+
+    def test_close(self):
+        """
+        Tests that at shutdown the unacknowledged messages are waited for
+        before disconnecting, and that the network loop is stopped last.
+        """
+        self._client.publish.return_value.is_published.return_value = False
+
+        _stage = MQTTOutputStage('localhost', 1883, 3600)
+        _stage.put(_messages('esp8266-1', 1))
+        _stage.close()
+
+        _calls = [_c[0] for _c in self._client.mock_calls]
+        _waits = [_i for _i, _c in enumerate(_calls)
+                  if _c == 'publish().wait_for_publish']
+
+        self.assertEqual(2, len(_waits))
+        self.assertLess(max(_waits), _calls.index('disconnect'))
+        self.assertLess(_calls.index('disconnect'), _calls.index('loop_stop'))
+
+
+if __name__ == '__main__':
+    unittest.main()